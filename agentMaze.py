@@ -13,7 +13,34 @@ def _alpha(n):
 	return 50. / (49 + n)
 
 
-def _getEstimates(transs, utils, currState, R_plus=None, N_e=None, currActions=None):
+def _outcomes(transs, state, ac, probs=None):
+	"""
+	Returns N_sa and probabilities ((newState, P(newState|state, ac)), ...)
+	of executing action ac in state. They are read from the probs
+	table if it is given (_update_probs keeps it up to date after
+	every step), otherwise they are counted from transs.
+	"""
+	if probs is not None:
+		return probs.get(state, {}).get(ac, (0, ()))
+	freq = transs.get(state, {}).get(ac, {})
+	n = sum(val for val in freq.values())
+	return n, [(key, float(val) / n) for key, val in freq.iteritems()]
+
+
+def _update_probs(transs, probs, state, action, newState, actions):
+	"""
+	Recalculate N_sa and probabilities of the executed action after
+	transs[state][action][newState] has been incremented. Only this
+	pair changes in one step, so nothing else is recalculated.
+	"""
+	freq = transs[state][action]
+	n = probs.setdefault(state, {}).get(action, (0, ()))[0] + 1
+	probs[state][action] = (n, tuple((key, float(val) / n) for key, val in freq.iteritems()))
+	for ac in actions:
+		probs.setdefault(newState, {}).setdefault(ac, (0, ()))
+
+
+def _getEstimates(transs, utils, currState, R_plus=None, N_e=None, currActions=None, probs=None):
 	"""
 	Gets estimates according to current transition states,
 	utility, current state and actions that can be executed
@@ -28,18 +55,16 @@ def _getEstimates(transs, utils, currState, R_plus=None, N_e=None, currActions=N
 		- get probabilities: divide freqs with n
 		- calculate estimate with bellman
 
+	If the probs table is given, counts and probabilities are
+	not recalculated, they are read from it.
+
 	Return (rewardEstimate, action) pairs in a dict
 	"""
 
 	estimates = []
 	for ac in (currActions or transs.get(currState, {})):
-		# We get N_s_a from transition table.
-		freq = transs.get(currState, {}).get(ac, {})
-
-		# Number of states.
-		n = sum(val for val in freq.values())
-		probs = dict((key, float(val) / n) for key, val in freq.iteritems())
-		u = sum(p * utils.get(s, 0) for s, p in probs.iteritems())
+		# We get N_s_a and probabilities from transition table.
+		n, outcomes = _outcomes(transs, currState, ac, probs)
 
 		# This if function f from page 842. Otherwise we are doing normal estimation.
 		# It means if the number of actions a that were executed in state s is not high enough,
@@ -47,29 +72,22 @@ def _getEstimates(transs, utils, currState, R_plus=None, N_e=None, currActions=N
 		if R_plus is not None and N_e is not None and n < N_e:
 			estimates.append((R_plus, ac, ))
 		else:
-			estimates.append((u, ac, ))
+			estimates.append((sum(p * utils.get(s, 0) for s, p in outcomes), ac, ))
 	return estimates
 
 
-def _policy_iteration(transs, utils, policy, rewards, R_plus=None, N_e=None, th=1):
+def _policy_iteration(transs, utils, policy, rewards, R_plus=None, N_e=None, th=1, probs=None):
 	changes = True
 	while changes:
 		for state in transs:
 			if state not in rewards:
 				continue
-			estimates = max(_getEstimates(transs, utils, state, R_plus, N_e))[0]
+			estimates = max(_getEstimates(transs, utils, state, R_plus, N_e, probs=probs))[0]
 			utils[state] = rewards[state] + th * estimates
 
 		changes = False
 		for state in transs:
-			estimates = []
-			for ac in transs.get(state, {}):
-				freq = transs.get(state, {}).get(ac, {})
-				# Number of states.
-				n = sum(val for val in freq.values())
-				probs = dict((key, float(val) / n) for key, val in freq.iteritems())
-	
-				estimates.append((sum(p * utils.get(s, 0) for s, p in probs.iteritems()), ac, ))
+			estimates = _getEstimates(transs, utils, state, probs=probs)
 	
 			if not estimates:
 				continue
@@ -123,9 +141,12 @@ def adp_random_exploration(env, transs={}, utils={}, freqs={}, policy={},
 	state = env.getStartingState()
 	rewardSum = 0
 
+	# Running N_sa and probabilities table.
+	probs = kwargs.get('probs')
+
 	# Get possible actions with respect to current state.
 	actions = env.getActions(state)
-	_policy_iteration(transs, utils, policy, rewards, th=alpha(itr))
+	_policy_iteration(transs, utils, policy, rewards, th=alpha(itr), probs=probs)
 	bestAction = policy.get(state, random.choice(actions))
 	
 	while not isTerminal: # while not terminal
@@ -152,7 +173,9 @@ def adp_random_exploration(env, transs={}, utils={}, freqs={}, policy={},
 		actions = env.getActions(newState)
 		for ac in actions:
 			transs.setdefault(newState, {}).setdefault(ac, {})
-		_policy_iteration(transs, utils, policy, rewards, th=alpha(itr))
+		if probs is not None:
+			_update_probs(transs, probs, state, bestAction, newState, actions)
+		_policy_iteration(transs, utils, policy, rewards, th=alpha(itr), probs=probs)
 		
 		bestAction = policy.get(newState, random.choice(actions))
 		
@@ -198,9 +221,11 @@ def adp_optimistic_rewards(env, transs={}, utils={}, freqs={}, policy={},
 	state = env.getStartingState()
 	rewardSum = 0
 
+	probs = kwargs.get('probs')
+
 	# Get possible actions with respect to current state.
 	actions = env.getActions(state)
-	_policy_iteration(transs, utils, policy, rewards, R_plus=R_plus, N_e=N_e, th=alpha(itr))
+	_policy_iteration(transs, utils, policy, rewards, R_plus=R_plus, N_e=N_e, th=alpha(itr), probs=probs)
 	bestAction = policy.get(state, random.choice(actions))
 
 	while not isTerminal: # while not terminal
@@ -228,7 +253,9 @@ def adp_optimistic_rewards(env, transs={}, utils={}, freqs={}, policy={},
 		actions = env.getActions(newState)
 		for ac in actions:
 			transs.setdefault(newState, {}).setdefault(ac, {})
-		_policy_iteration(transs, utils, policy, rewards, R_plus=R_plus, N_e=N_e, th=alpha(itr))
+		if probs is not None:
+			_update_probs(transs, probs, state, bestAction, newState, actions)
+		_policy_iteration(transs, utils, policy, rewards, R_plus=R_plus, N_e=N_e, th=alpha(itr), probs=probs)
 
 		#rewardEstimate, bestAction = max(_getEstimatesOptimistic(transs, utils, state, R_plus, N_e, actions))
 		bestAction = policy.get(newState, random.choice(actions))
@@ -264,6 +291,9 @@ class Agent():
 		# Rewards table
 		self.rewardsTable = {}
 
+		# Running N_sa and probabilities table.
+		self.probsTable = {}
+
 		# history
 		self.history = []
 		
@@ -271,7 +301,7 @@ class Agent():
 		policy = {}
 		# For every state set appropriate action.
 		for state in self.transTable:
-			policy[state] = max(_getEstimates(self.transTable, self.uTable, state))[1]
+			policy[state] = max(_getEstimates(self.transTable, self.uTable, state, probs=self.probsTable))[1]
 		return policy
 
 	def learn(self, env, alg=adp_random_exploration, numOfTrials=150, **kwargs):
@@ -294,6 +324,7 @@ class Agent():
 						results=self.results,
 						policy=self.policyTable,
 						rewards=self.rewardsTable,
+						probs=self.probsTable,
 						**kwargs)
 			itrs += currItrs
 
@@ -1,5 +1,31 @@
+import heapq
+import math
+import os
 import random
+import time
+import warnings
+from collections import deque
+import checkpoint
 import environments as env
+import interning
+import models
+import storage
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+try:
+	import scipy.sparse
+	import scipy.sparse.linalg
+except ImportError:
+	scipy = None
+
+
+# Smallest number of states for which _linear_policy_iteration solves the
+# utilities exactly, on smaller models sweeping is faster.
+LINEAR_STATES = 800
 
 def _alpha(n):
 	"""
@@ -12,7 +38,56 @@ def _alpha(n):
 	return 50. / (49 + n)
 
 
-def _getEstimates(transs, utils, currState, R_plus=None, N_e=None, currActions=None):
+def _outcomes(transs, state, ac, probs=None, succs=None):
+	"""
+	Returns N_sa and probabilities ((newState, P(newState|state, ac)), ...)
+	of executing action ac in state. They are read from the succs
+	table (deterministic environments) or the probs table if one is
+	given (_update_model keeps them up to date after every step),
+	otherwise they are counted from transs.
+	"""
+	if succs is not None:
+		n, newState = succs.get(state, {}).get(ac, (0, None))
+		return n, ((newState, 1.), ) if newState is not None else ()
+	if probs is not None:
+		return probs.get(state, {}).get(ac, (0, ()))
+	freq = transs.get(state, {}).get(ac, {})
+	n = sum(val for val in freq.values())
+	return n, [(key, float(val) / n) for key, val in freq.iteritems()]
+
+
+def _optimistic(R_plus, state, action):
+	"""
+	Optimistic estimate of action in state: R_plus, or R_plus(state, action) if it is a function.
+	"""
+	return R_plus(state, action) if callable(R_plus) else R_plus
+
+
+class _HeuristicOptimism():
+	"""
+	Optimistic estimate of an action from env.optimisticValue, used as
+	R_plus: R_plus shifted by how much the estimate of the state the
+	action leads to is better than the one of the state itself. So it
+	is on the same scale as R_plus, actions which push a box closer to
+	a goal get more, walking R_plus, pushing a box away less and actions
+	into a deadlock much less. Values are cached per (state, action),
+	the estimate depends only on them.
+	"""
+	def __init__(self, env, R_plus):
+		self.env = env
+		self.R_plus = R_plus
+		self.values = {}
+
+	def __call__(self, state, action):
+		value = self.values.get((state, action))
+		if value is None:
+			env = self.env
+			value = self.values[(state, action)] = \
+				self.R_plus + env.optimisticValue(state, action) - env.optimisticValue(state)
+		return value
+
+
+def _getEstimates(transs, utils, currState, R_plus=None, N_e=None, currActions=None, probs=None, succs=None):
 	"""
 	Gets estimates according to current transition states,
 	utility, current state and actions that can be executed
@@ -27,59 +102,622 @@ def _getEstimates(transs, utils, currState, R_plus=None, N_e=None, currActions=N
 		- get probabilities: divide freqs with n
 		- calculate estimate with bellman
 
+	If the probs table is given, counts and probabilities are
+	not recalculated, they are read from it. If the succs table
+	is given (deterministic environment), every action has a single
+	successor and its utility is the estimate.
+
 	Return (rewardEstimate, action) pairs in a dict
 	"""
 
 	estimates = []
-	for ac in (currActions or transs.get(currState, {})):
-		# We get N_s_a from transition table.
-		freq = transs.get(currState, {}).get(ac, {})
+	if succs is not None:
+		for ac, (n, newState) in succs.get(currState, {}).iteritems():
+			if currActions and ac not in currActions:
+				continue
+			if R_plus is not None and N_e is not None and n < N_e:
+				estimates.append((_optimistic(R_plus, currState, ac), ac, ))
+			else:
+				estimates.append((utils.get(newState, 0) if newState is not None else 0, ac, ))
+		return estimates
 
-		# Number of states.
-		n = sum(val for val in freq.values())
-		probs = dict((key, float(val) / n) for key, val in freq.iteritems())
-		u = sum(p * utils.get(s, 0) for s, p in probs.iteritems())
+	for ac in (currActions or transs.get(currState, {})):
+		# We get N_s_a and probabilities from transition table.
+		n, outcomes = _outcomes(transs, currState, ac, probs)
 
 		# This if function f from page 842. Otherwise we are doing normal estimation.
 		# It means if the number of actions a that were executed in state s is not high enough,
 		# it means we should set some optimistic reward to search more into that direction.
 		if R_plus is not None and N_e is not None and n < N_e:
-			estimates.append((R_plus, ac, ))
+			estimates.append((_optimistic(R_plus, currState, ac), ac, ))
 		else:
-			estimates.append((u, ac, ))
+			estimates.append((sum(p * utils.get(s, 0) for s, p in outcomes), ac, ))
 	return estimates
 
 
-def _policy_iteration(transs, utils, policy, rewards, R_plus=None, N_e=None, th=1):
+def _sweep_order(transs, order=None, **kwargs):
+	"""
+	Order in which _policy_iteration visits the states of transs.
+
+	@param order: None (order of transs), 'insertion' (order in which states
+		were added, needs states), 'reverse_topological' (breadth first from
+		terminal states over predecessors, needs terminals and preds) or
+		'frequency' (most visited states first, needs freqs).
+	"""
+	if order == 'insertion' and kwargs.get('states') is not None:
+		return kwargs['states']
+	if order == 'reverse_topological' and kwargs.get('preds') is not None:
+		preds = kwargs['preds']
+		states = [state for state in kwargs.get('terminals', ()) if state in transs]
+		visited = set(states)
+		for state in states:
+			for pred in preds.get(state, ()):
+				if pred not in visited:
+					visited.add(pred)
+					states.append(pred)
+		return states + [state for state in transs if state not in visited]
+	if order == 'frequency' and kwargs.get('freqs') is not None:
+		freqs = kwargs['freqs']
+		return sorted(transs, key=lambda state: freqs.get(state, 0), reverse=True)
+	return transs
+
+
+def _policy_iteration(transs, utils, policy, rewards, R_plus=None, N_e=None, th=1, **kwargs):
+	"""
+	Policy iteration on the learned model. Utilities are updated in
+	place (Gauss-Seidel), state after state in the sweep order, then
+	the policy is improved. It is repeated until the policy does not
+	change any more, or until one of the optional bounds is reached.
+
+	@param probs: Table of N_sa and probabilities kept by _update_model, optional.
+	@param succs: Table of N_sa and single successors kept by _update_model
+		for deterministic environments, optional (used instead of probs).
+	@param order: Sweep order, see _sweep_order.
+	@param maxSweeps: Maximum number of sweeps per call.
+	@param tol: Stop when the Bellman residual (the largest utility change in a sweep) is at most tol.
+	@param timeBudget: Stop after this many seconds.
+
+	Returns (number of sweeps, Bellman residual of the last sweep).
+	"""
+	probs = kwargs.get('probs')
+	succs = kwargs.get('succs')
+	maxSweeps = kwargs.get('maxSweeps')
+	tol = kwargs.get('tol')
+	timeBudget = kwargs.get('timeBudget')
+	deadline = time.time() + timeBudget if timeBudget is not None else None
+	states = _sweep_order(transs, **kwargs)
+
+	sweeps, residual = 0, 0.
 	changes = True
 	while changes:
-		for state in transs:
+		residual = 0.
+		for state in states:
 			if state not in rewards:
 				continue
-			estimates = max(_getEstimates(transs, utils, state, R_plus, N_e))[0]
-			utils[state] = rewards[state] + th * estimates
+			estimates = max(_getEstimates(transs, utils, state, R_plus, N_e, probs=probs, succs=succs))[0]
+			util = rewards[state] + th * estimates
+			residual = max(residual, abs(util - utils.get(state, 0)))
+			utils[state] = util
 	
-		changes = False
-		for state in transs:
-			estimates = []
-			for ac in transs.get(state, {}):
-				freq = transs.get(state, {}).get(ac, {})
-				# Number of states.
-				n = sum(val for val in freq.values())
-				probs = dict((key, float(val) / n) for key, val in freq.iteritems())
-	
-				estimates.append((sum(p * utils.get(s, 0) for s, p in probs.iteritems()), ac, ))
-	
-			if not estimates:
-				continue
-			
-			maxEst, maxAct = max(estimates)
-	
-			polEst = dict((act, est, ) for est, act in estimates)[policy.get(state, maxAct)]
-	
-			if maxEst > polEst or policy.get(state, None) is None:
-				policy[state] = maxAct
-				changes = True
+		changes = _improve_policy(transs, utils, policy, states, probs, succs)
+
+		sweeps += 1
+		if maxSweeps is not None and sweeps >= maxSweeps or \
+		   tol is not None and residual <= tol or \
+		   deadline is not None and time.time() >= deadline:
+			break
+	return sweeps, residual
+
+
+def _improve_policy(transs, utils, policy, states, probs=None, succs=None, eps=0):
+	"""
+	Policy improvement step: the policy of every state is changed to
+	the best action by the current utilities if it is strictly better
+	(by more than eps).
+
+	Returns True if the policy has changed.
+	"""
+	changes = False
+	for state in states:
+		estimates = _getEstimates(transs, utils, state, probs=probs, succs=succs)
+
+		if not estimates:
+			continue
+		
+		maxEst, maxAct = max(estimates)
+
+		polEst = dict((act, est, ) for est, act in estimates)[policy.get(state, maxAct)]
+
+		if maxEst > polEst + eps or policy.get(state, None) is None:
+			policy[state] = maxAct
+			changes = True
+	return changes
+
+
+def _evaluate_exactly(transs, utils, rewards, states, actions, R_plus=None, N_e=None, th=1, probs=None, succs=None,
+					  equations=None):
+	"""
+	Exact evaluation of fixed actions: solves the linear system
+	U(s) = R(s) + th * sum_s' P(s'|s, actions[s]) U(s') for states,
+	with a sparse direct solver (scipy.sparse.linalg) or dense NumPy.
+	Utilities of other states are constants, and so are estimates
+	of actions tried less than N_e times (R_plus).
+
+	@param equations: Dict of the equations of (state, action) pairs
+		which is filled and reused by the following calls, only while
+		the model, rewards, th, states and utilities of other states
+		do not change (i.e. within one _linear_policy_iteration).
+
+	Returns the largest utility change, or None if the system is
+	singular (i.e. th >= 1 and a cycle without terminal states).
+	"""
+	if equations is None:
+		equations = {}
+	index = dict((state, i) for i, state in enumerate(states))
+	# I - th * P is built at once, the diagonal first.
+	rows, cols, vals = range(len(states)), range(len(states)), [1.] * len(states)
+	b = []
+	for i, state in enumerate(states):
+		equation = equations.get((state, actions[state]))
+		if equation is None:
+			equation = equations[(state, actions[state])] = \
+				_equation(transs, utils, rewards, index, state, actions[state], R_plus, N_e, th, probs, succs)
+		eqCols, eqVals, const = equation
+		rows.extend([i] * len(eqCols))
+		cols.extend(eqCols)
+		vals.extend(eqVals)
+		b.append(const)
+	b = np.array(b)
+
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore')
+		try:
+			if scipy is not None:
+				matrix = scipy.sparse.csc_matrix((vals, (rows, cols)), shape=(len(states), len(states)))
+				solution = scipy.sparse.linalg.spsolve(matrix, b)
+			else:
+				matrix = np.zeros((len(states), len(states)))
+				np.add.at(matrix, (rows, cols), vals)
+				solution = np.linalg.solve(matrix, b)
+		except (np.linalg.LinAlgError, RuntimeError):
+			return None
+	solution = np.atleast_1d(solution)
+	if not np.isfinite(solution).all():
+		return None
+
+	residual = 0.
+	for state, util in zip(states, solution.tolist()):
+		residual = max(residual, abs(util - utils.get(state, 0)))
+		utils[state] = util
+	return residual
+
+
+def _equation(transs, utils, rewards, index, state, action, R_plus=None, N_e=None, th=1, probs=None, succs=None):
+	"""
+	Row of state in the system of _evaluate_exactly: (columns, values
+	of -th * P(s'|s, a) of the states in index, constant part).
+	"""
+	n, outcomes = _outcomes(transs, state, action, probs, succs)
+	if R_plus is not None and N_e is not None and n < N_e:
+		return [], [], rewards[state] + th * _optimistic(R_plus, state, action)
+	eqCols, eqVals, const = [], [], rewards[state]
+	for newState, p in outcomes:
+		j = index.get(newState)
+		if j is None:
+			const += th * p * utils.get(newState, 0)
+		else:
+			eqCols.append(j)
+			eqVals.append(-th * p)
+	return eqCols, eqVals, const
+
+
+def _linear_policy_iteration(transs, utils, policy, rewards, R_plus=None, N_e=None, th=1, **kwargs):
+	"""
+	Policy iteration where the utilities of the policy are not
+	updated with sweeps but solved exactly (see _evaluate_exactly),
+	then the same improvement step as in _policy_iteration is done.
+	It is repeated until the policy does not change, every policy
+	is evaluated once. States without a policy are evaluated with
+	their best (optimistic) action.
+
+	Solving costs more than a sweep, so on models with fewer than
+	linearStates states, if th >= 1 (the system may be singular) or
+	without NumPy it falls back to _policy_iteration. If the system
+	is singular anyway, one sweep is done instead.
+
+	@param probs, succs: Model tables as in _policy_iteration.
+	@param maxSweeps, tol, timeBudget, order: Bounds and order as in _policy_iteration,
+		maxSweeps bounds the number of evaluations.
+	@param linearStates: Smallest model solved exactly, LINEAR_STATES by default.
+
+	Returns (number of evaluations, largest utility change of the last one).
+	"""
+	probs = kwargs.get('probs')
+	succs = kwargs.get('succs')
+	order = _sweep_order(transs, **kwargs)
+	states = [state for state in order if state in rewards and transs.get(state)]
+	if np is None or th >= 1 or len(states) < kwargs.get('linearStates', LINEAR_STATES):
+		return _policy_iteration(transs, utils, policy, rewards, R_plus, N_e, th, **kwargs)
+	maxSweeps = kwargs.get('maxSweeps')
+	tol = kwargs.get('tol')
+	timeBudget = kwargs.get('timeBudget')
+	deadline = time.time() + timeBudget if timeBudget is not None else None
+
+	sweeps, residual = 0, 0.
+	equations = {}
+	changes = True
+	while changes:
+		actions = {}
+		for state in states:
+			ac = policy.get(state)
+			if ac is None or ac not in transs[state]:
+				ac = max(_getEstimates(transs, utils, state, R_plus, N_e, probs=probs, succs=succs))[1]
+			actions[state] = ac
+
+		residual = _evaluate_exactly(transs, utils, rewards, states, actions, R_plus, N_e, th, probs, succs, equations)
+		if residual is None:
+			residual = 0.
+			for state in states:
+				util = rewards[state] + th * max(_getEstimates(transs, utils, state, R_plus, N_e, probs=probs, succs=succs))[0]
+				residual = max(residual, abs(util - utils.get(state, 0)))
+				utils[state] = util
+
+		# Actions whose exact utilities differ only by rounding would swap forever.
+		changes = _improve_policy(transs, utils, policy, order, probs, succs, eps=1e-9)
+
+		sweeps += 1
+		if maxSweeps is not None and sweeps >= maxSweeps or \
+		   tol is not None and residual <= tol or \
+		   deadline is not None and time.time() >= deadline:
+			break
+	return sweeps, residual
+
+
+def _backup(transs, utils, policy, rewards, state, R_plus=None, N_e=None, th=1, probs=None, succs=None):
+	"""
+	Bellman backup of a single state. It is the same update
+	that _policy_iteration does for every state, only restricted
+	to one state: the utility is recalculated from the (optimistic)
+	estimates and the policy is changed if a better action exists.
+
+	Returns the absolute change of the utility of state.
+	"""
+	oldUtil = utils.get(state, 0)
+	if state in rewards and transs.get(state):
+		estimates = max(_getEstimates(transs, utils, state, R_plus, N_e, probs=probs, succs=succs))[0]
+		utils[state] = rewards[state] + th * estimates
+
+	estimates = _getEstimates(transs, utils, state, probs=probs, succs=succs)
+	if estimates:
+		maxEst, maxAct = max(estimates)
+		polEst = dict((act, est, ) for est, act in estimates)[policy.get(state, maxAct)]
+		if maxEst > polEst or policy.get(state, None) is None:
+			policy[state] = maxAct
+	return abs(utils.get(state, 0) - oldUtil)
+
+
+class PriorityQueue():
+	"""
+	Max-priority queue of states for _prioritized_sweeping. Every
+	state is queued at most once, with its highest priority. Heap
+	entries made obsolete by a higher priority are skipped on pop.
+	"""
+	def __init__(self):
+		self.heap = []
+		self.priorities = {}
+
+	def __len__(self):
+		return len(self.priorities)
+
+	def push(self, state, priority):
+		if priority > self.priorities.get(state, -1):
+			self.priorities[state] = priority
+			heapq.heappush(self.heap, (-priority, state))
+
+	def pop(self):
+		while True:
+			priority, state = heapq.heappop(self.heap)
+			if self.priorities.get(state) == -priority:
+				del self.priorities[state]
+				return state
+
+	def items(self):
+		"""
+		(state, priority) pairs of the queued states.
+		"""
+		return self.priorities.iteritems()
+
+	def update(self, items):
+		for state, priority in items:
+			self.push(state, priority)
+
+
+def _prioritized_sweeping(transs, utils, policy, rewards, R_plus=None, N_e=None, th=1, **kwargs):
+	"""
+	Prioritized sweeping planner (Moore & Atkeson). Instead of
+	sweeping over the whole model until the policy is stable it
+	keeps a priority queue of states ordered by their Bellman error.
+	The states whose model has just changed are backed up first,
+	then the predecessors of every state whose utility changed are
+	queued with priority |change| * P(state|pred, action).
+
+	At most budget backups are done per call, so the cost of one
+	step does not grow with the size of the model. What is left in
+	the queue is processed in the following steps.
+
+	@param preds: Predecessors table (newState => set of states), filled by _update_model.
+	@param queue: PriorityQueue which is kept between calls.
+	@param changed: States whose model has just changed.
+	@param budget: Maximum number of backups per call.
+	@param theta: Smallest priority that is still queued.
+
+	Returns (number of backups, largest utility change).
+	"""
+	preds = kwargs.get('preds') or {}
+	probs = kwargs.get('probs')
+	succs = kwargs.get('succs')
+	queue = kwargs.get('queue')
+	if queue is None:
+		queue = PriorityQueue()
+	budget = kwargs.get('budget', 20)
+	theta = kwargs.get('theta', 1e-3)
+
+	for state in kwargs.get('changed', ()):
+		queue.push(state, float('inf'))
+
+	backups, residual = 0, 0.
+	while queue and backups < budget:
+		state = queue.pop()
+		delta = _backup(transs, utils, policy, rewards, state, R_plus, N_e, th, probs, succs)
+		residual = max(residual, delta)
+		backups += 1
+		if delta <= theta:
+			continue
+
+		# Queue predecessors by how likely they lead into state.
+		for pred in preds.get(state, ()):
+			prob = 0.
+			for ac in transs.get(pred, {}):
+				prob = max([prob] + [p for s, p in _outcomes(transs, pred, ac, probs, succs)[1] if s == state])
+			if delta * prob > theta:
+				queue.push(pred, delta * prob)
+	return backups, residual
+
+
+def _rtdp(transs, utils, policy, rewards, R_plus=None, N_e=None, th=1, **kwargs):
+	"""
+	Real-time dynamic programming (RTDP / LRTA*) planner. Only the
+	states around the agent are backed up: first the states visited
+	in the current trial, each once, from the newest to the oldest,
+	then the states reachable from newState through the learned model
+	in at most depth steps (deepest first, at most the lookahead share
+	of budget) and last the states of a greedy trial simulated on the
+	learned model from the starting state. At most budget backups are
+	done, so the cost of a step depends on depth and budget and not
+	on the number of states in transs.
+
+	The algorithms call the planner once at the start of every trial
+	without changed, then the trajectory is emptied.
+
+	@param changed: (state, newState) of the last step.
+	@param trajectory: List of the states visited in the current trial, kept between calls.
+	@param depth: Depth of the lookahead from newState.
+	@param budget: Maximum number of backups per call.
+	@param lookahead: Largest share of budget used by the states reachable from newState (default 0.5).
+
+	Returns (number of backups, largest utility change).
+	"""
+	probs = kwargs.get('probs')
+	succs = kwargs.get('succs')
+	trajectory = kwargs.get('trajectory')
+	if trajectory is None:
+		trajectory = []
+	depth = kwargs.get('depth', 2)
+	budget = kwargs.get('budget', 50)
+
+	changed = kwargs.get('changed')
+	if not changed:
+		del trajectory[:]
+		return 0, 0.
+	state, newState = changed
+	if not trajectory:
+		trajectory.append(state)
+	trajectory.append(newState)
+
+	# Trajectory states from the newest, a state visited again is backed up once.
+	order, visited = [], set()
+	for s in reversed(trajectory):
+		if s not in visited:
+			visited.add(s)
+			order.append(s)
+
+	# Breadth first lookahead through the learned outcomes, it gets at most
+	# the lookahead share of the budget.
+	rollout = int(budget * kwargs.get('lookahead', 0.5))
+	layers, seen = [[newState]], set([newState])
+	while len(layers) <= depth and len(seen) <= rollout:
+		layer = []
+		for s in layers[-1]:
+			for ac in transs.get(s, {}):
+				for nextState, p in _outcomes(transs, s, ac, probs, succs)[1]:
+					if nextState not in seen and len(seen) <= rollout:
+						seen.add(nextState)
+						layer.append(nextState)
+		if not layer:
+			break
+		layers.append(layer)
+	order += [s for layer in reversed(layers[1:]) for s in layer if s not in visited]
+
+	backups, residual = 0, 0.
+	for s in order[:budget]:
+		residual = max(residual, _backup(transs, utils, policy, rewards, s, R_plus, N_e, th, probs, succs))
+		backups += 1
+
+	# The simulated trial follows the policy through the most likely outcomes,
+	# so the path on which the policy is tried is backed up with the rest of
+	# the budget. A state is backed up again when the trial returns to it.
+	s = trajectory[0]
+	while backups < budget and transs.get(s):
+		residual = max(residual, _backup(transs, utils, policy, rewards, s, R_plus, N_e, th, probs, succs))
+		backups += 1
+		outcomes = _outcomes(transs, s, policy.get(s), probs, succs)[1]
+		if not outcomes:
+			break
+		s = max(outcomes, key=lambda (nextState, p): p)[0]
+	return backups, residual
+
+
+def _sparse_policy_iteration(transs, utils, policy, rewards, R_plus=None, N_e=None, th=1, **kwargs):
+	"""
+	The same policy iteration as _policy_iteration, but the sweeps
+	are done on the array backed models.SparseModel (vectorized over
+	all states) instead of on the nested transs dicts. The model is
+	kept up to date by _update_model, utilities and changed policy
+	entries are written back into utils and policy.
+
+	Utilities are updated in place in the same sweep order (see
+	SparseModel.schedule), so the result is the same as that of
+	_policy_iteration. Only expected utilities of actions with
+	several outcomes can differ in the last bits, their products are
+	summed by numpy.
+
+	@param model: models.SparseModel, falls back to _policy_iteration if None
+		(or if R_plus is a function).
+	@param changed: States whose reward may have changed.
+	@param order: Sweep order, see _sweep_order.
+	@param maxSweeps, tol, timeBudget: Bounds as in _policy_iteration.
+
+	Returns (number of sweeps, Bellman residual of the last sweep).
+	"""
+	model = kwargs.get('model')
+	if model is None or callable(R_plus):
+		return _policy_iteration(transs, utils, policy, rewards, R_plus, N_e, th, **kwargs)
+
+	if not model and transs:
+		model.load(transs, utils, rewards, policy)
+	for state in kwargs.get('changed', ()):
+		if state in rewards:
+			model.setReward(state, rewards[state])
+
+	maxSweeps = kwargs.get('maxSweeps')
+	tol = kwargs.get('tol')
+	timeBudget = kwargs.get('timeBudget')
+	deadline = time.time() + timeBudget if timeBudget is not None else None
+	sids = np.fromiter((model.stateIds[state] for state in _sweep_order(transs, **kwargs)), np.int64)
+	sids = sids[model.hasReward.view()[sids]]
+
+	sweeps, residual, changes = 0, 0., True
+	while changes:
+		residual = model.sweep(sids, th, R_plus, N_e)
+		states, rows = model.improve()
+		for sid, row in zip(states, rows):
+			policy[model.states[sid]] = model.actions[model.rowAction.data[row]]
+		changes = len(states) > 0
+
+		sweeps += 1
+		if maxSweeps is not None and sweeps >= maxSweeps or \
+		   tol is not None and residual <= tol or \
+		   deadline is not None and time.time() >= deadline:
+			break
+	model.store(utils, sids)
+	return sweeps, residual
+
+
+# Planners that can be selected with the planner parameter of the algorithms.
+PLANNERS = {
+	'policy_iteration': _policy_iteration,
+	'prioritized_sweeping': _prioritized_sweeping,
+	'sparse_policy_iteration': _sparse_policy_iteration,
+	'linear_policy_iteration': _linear_policy_iteration,
+	'rtdp': _rtdp,
+}
+
+
+def _plan(transs, utils, policy, rewards, kwargs, **params):
+	"""
+	Run the planner selected in kwargs (by name or as a function).
+	By default it is _policy_iteration, or _sparse_policy_iteration
+	if a sparse model is given. The planner gets the algorithm
+	keyword arguments, overridden by params.
+	"""
+	planner = kwargs.get('planner', _policy_iteration if kwargs.get('model') is None else _sparse_policy_iteration)
+	planner = PLANNERS.get(planner, planner)
+	options = dict(kwargs)
+	options.update(params)
+	return planner(transs, utils, policy, rewards, **options)
+
+
+def _update_model(transs, state, action, newState, actions, **kwargs):
+	"""
+	Record that executing action in state resulted in newState
+	and register actions that can be executed in newState.
+
+	@param preds: Predecessors table (newState => set of states), optional.
+	@param probs: Table (state => action => (N_sa, probabilities)), optional.
+	@param succs: Table (state => action => (N_sa, newState)) for deterministic
+		environments, optional.
+	@param model: models.SparseModel which is updated as well, optional.
+	@param states: List of states in order of insertion into transs, optional.
+	@param terminals: Set of terminal states, optional.
+	@param isTerminal: Whether newState is terminal.
+	"""
+	states = kwargs.get('states')
+	if states is not None:
+		if state not in transs:
+			states.append(state)
+		if actions and newState not in transs and newState != state:
+			states.append(newState)
+
+	terminals = kwargs.get('terminals')
+	if terminals is not None and kwargs.get('isTerminal'):
+		terminals.add(newState)
+
+	# update transition table. The first one returns dictionary of actions for specific state and the
+	# second one a dictionary of possible states from specific action (best action).
+	transs.setdefault(state, {}).setdefault(action, {}).setdefault(newState, 0)
+	transs[state][action][newState] += 1
+
+	for ac in actions:
+		transs.setdefault(newState, {}).setdefault(ac, {})
+
+	# Only N_sa and probabilities of the executed action change, so only
+	# they are recalculated, instead of in every sweep for every state.
+	probs = kwargs.get('probs')
+	if probs is not None:
+		freq = transs[state][action]
+		n = probs.setdefault(state, {}).get(action, (0, ()))[0] + 1
+		probs[state][action] = (n, tuple((key, float(val) / n) for key, val in freq.iteritems()))
+		for ac in actions:
+			probs.setdefault(newState, {}).setdefault(ac, (0, ()))
+
+	# In a deterministic environment the only successor is newState,
+	# so only N_sa is counted and nothing is normalized.
+	succs = kwargs.get('succs')
+	if succs is not None:
+		outcome = succs.setdefault(state, {}).get(action, (0, None))
+		succs[state][action] = (outcome[0] + 1, newState)
+		for ac in actions:
+			succs.setdefault(newState, {}).setdefault(ac, (0, None))
+
+	preds = kwargs.get('preds')
+	if preds is not None:
+		preds.setdefault(newState, set()).add(state)
+
+	model = kwargs.get('model')
+	if model is not None:
+		model.add(state, action, newState)
+		model.addActions(newState, actions)
+
+
+def _explore(transs, utils, state, actions, R_plus, N_e, probs=None, succs=None, default=None):
+	"""
+	Action with the best optimistic estimate in state (default if
+	there are none). The policy ranks actions by their learned
+	estimates only, so the actions tried less than N_e times are
+	ranked by R_plus here, which matters if it differs per action.
+	"""
+	estimates = _getEstimates(transs, utils, state, R_plus, N_e, actions, probs, succs)
+	return max(estimates)[1] if estimates else default
 
 
 def adp_random_exploration(env, transs={}, utils={}, freqs={}, policy={},
@@ -107,6 +745,8 @@ def adp_random_exploration(env, transs={}, utils={}, freqs={}, policy={},
 	@param tStep: A step to increment parameter t.
 	@param alpha: Step size function
 	@param maxItr: Maximum iterations
+	@param planner: Planner run after every step (a function or a name from PLANNERS).
+	@param maxSweeps, tol, timeBudget, order: Bounds and sweep order of the planner (see _policy_iteration).
 	"""
 
 	
@@ -126,7 +766,7 @@ def adp_random_exploration(env, transs={}, utils={}, freqs={}, policy={},
 	
 	# Get possible actions with respect to current state.
 	actions = env.getActions(state)
-	_policy_iteration(transs, utils, policy, rewards, th=alpha(itr) )
+	_plan(transs, utils, policy, rewards, kwargs, th=alpha(itr), freqs=freqs)
 	bestAction = policy.get(state, random.choice(actions))
 	
 	while not isTerminal: # while not terminal
@@ -148,17 +788,11 @@ def adp_random_exploration(env, transs={}, utils={}, freqs={}, policy={},
 		freqs.setdefault(newState, 0)
 		freqs[newState] += 1
 
-		# update transition table. The first one returns dictionary of actions for specific state and the
-		# second one a dictionary of possible states from specific action (best action).
-		transs.setdefault(state, {}).setdefault(bestAction, {}).setdefault(newState, 0)
-		transs[state][bestAction][newState] += 1
-
 		actions = env.getActions(newState)
-		for ac in actions:
-			transs.setdefault(newState, {}).setdefault(ac, {})
-		_policy_iteration(transs, utils, policy, rewards, th=alpha(itr))
+		_update_model(transs, state, bestAction, newState, actions, isTerminal=isTerminal, **kwargs)
+		_plan(transs, utils, policy, rewards, kwargs, th=alpha(itr), freqs=freqs, changed=(state, newState))
 		
-		bestAction = policy.get(newState, random.choice(actions))
+		bestAction = policy.get(newState, random.choice(actions) if actions else None)
 		
 		# Is this part from the book:
 		# Having obtained a utility function U that is optimal for the learned model,
@@ -188,11 +822,20 @@ def adp_optimistic_rewards(env, transs={}, utils={}, freqs={}, policy={},
 	@param freqs: A table of frequencies (N_sa) for state-action pairs, initially zero.
 	@param R_plus: An optimistic estimate of the best possible reward obtainable in any state.
 	@param N_e: Limit of how many number of optimistic reward is given before true utility.
+	@param optimism: 'constant' (default) uses R_plus for every action, 'heuristic'
+		shifts it by the change of env.optimisticValue the action makes (a per level
+		estimate, i.e. from push distances of boxes to goals in Sokoban) if env
+		has it, see _HeuristicOptimism. The agent then also acts by these
+		estimates (see _explore).
 	@param alpha: Step size function
 	@param maxItr: Maximum iterations
+	@param planner: Planner run after every step (a function or a name from PLANNERS).
+	@param maxSweeps, tol, timeBudget, order: Bounds and sweep order of the planner (see _policy_iteration).
 	"""
 	R_plus = kwargs.get('R_plus', 5)
 	N_e = kwargs.get('N_e', 12)
+	if kwargs.get('optimism') == 'heuristic' and hasattr(env, 'optimisticValue'):
+		R_plus = _HeuristicOptimism(env, R_plus)
 	alpha = kwargs.get('alpha', _alpha)
 	maxItr = kwargs.get('maxItr', 10)
 
@@ -205,8 +848,10 @@ def adp_optimistic_rewards(env, transs={}, utils={}, freqs={}, policy={},
 	
 	# Get possible actions with respect to current state.
 	actions = env.getActions(state)
-	_policy_iteration(transs, utils, policy, rewards, R_plus=R_plus, N_e=N_e, th=alpha(itr))
+	_plan(transs, utils, policy, rewards, kwargs, R_plus=R_plus, N_e=N_e, th=alpha(itr), freqs=freqs)
 	bestAction = policy.get(state, random.choice(actions))
+	if callable(R_plus):
+		bestAction = _explore(transs, utils, state, actions, R_plus, N_e, kwargs.get('probs'), kwargs.get('succs'), bestAction)
 
 	while not isTerminal: # while not terminal
 		if bestAction is None:
@@ -225,19 +870,17 @@ def adp_optimistic_rewards(env, transs={}, utils={}, freqs={}, policy={},
 		freqs.setdefault(newState, 0)
 		freqs[newState] += 1
 
-		# update transition table. The first one returns dictionary of actions for specific state and the
-		# second one a dictionary of possible states from specific action (best action).
-		transs.setdefault(state, {}).setdefault(bestAction, {}).setdefault(newState, 0)
-		transs[state][bestAction][newState] += 1
-
 		# We need to get actions on new state.
 		actions = env.getActions(newState)
-		for ac in actions:
-			transs.setdefault(newState, {}).setdefault(ac, {})
-		_policy_iteration(transs, utils, policy, rewards, R_plus=R_plus, N_e=N_e, th=alpha(itr))
+		_update_model(transs, state, bestAction, newState, actions, isTerminal=isTerminal, **kwargs)
+		_plan(transs, utils, policy, rewards, kwargs, R_plus=R_plus, N_e=N_e, th=alpha(itr), freqs=freqs,
+			  changed=(state, newState))
 
 		#rewardEstimate, bestAction = max(_getEstimatesOptimistic(transs, utils, state, R_plus, N_e, actions))
-		bestAction = policy.get(newState, random.choice(actions))
+		bestAction = policy.get(newState, random.choice(actions) if actions else None)
+		if callable(R_plus):
+			bestAction = _explore(transs, utils, newState, actions, R_plus, N_e, kwargs.get('probs'), kwargs.get('succs'),
+								  bestAction)
 		state = newState
 
 		itr += 1
@@ -246,12 +889,189 @@ def adp_optimistic_rewards(env, transs={}, utils={}, freqs={}, policy={},
 	return itr, rewardSum, lastReward
 
 
+def _td_learning(env, transs, utils, freqs, policy, rewards, sarsa, **kwargs):
+	"""
+	One trial of temporal difference learning of Q(s, a) in the
+	QTable q. No model is learned and nothing is planned, so the
+	cost of a step does not depend on the number of known states.
+	Actions are chosen with the same GLIE scheme as in
+	adp_random_exploration. The policy and utilities of updated
+	states are kept greedy with respect to Q, so Agent.solve and
+	getPolicy work as with the other algorithms.
+
+	With sarsa the target is r + gamma * Q(s', a') for the action a'
+	which is executed next, and the update is spread over the last
+	traceLength pairs with eligibility (gamma * lam) ** k. Otherwise
+	it is r + gamma * max Q(s', .) (one step Q-learning).
+
+	With planningSteps > 0 (Dyna-Q) the model is learned as well
+	(_update_model) and after every real step planningSteps pairs
+	which were already tried are drawn at random and backed up from
+	the model: Q(s, a) moves towards the expected value of
+	rewards[s'] + gamma * max Q(s', .) over the learned outcomes.
+	"""
+	q = kwargs.get('q')
+	if q is None:
+		q = models.QTable(kwargs.get('Q_init', 0.))
+	tStep = kwargs.get('tStep', 0.01)
+	alpha = kwargs.get('alpha', _alpha)
+	maxItr = kwargs.get('maxItr', 50)
+	tFac = kwargs.get('tFac', 1.)
+	t = kwargs.get('currItrs', 0)/5 if kwargs.get('remember', False) else 0
+	minRnd = kwargs.get('minRnd', 0.0)
+	gamma = kwargs.get('gamma', 0.95)
+	lam = kwargs.get('lam', 0.9) if sarsa else 0.
+	planningSteps = kwargs.get('planningSteps', 0)
+	probs = kwargs.get('probs')
+	succs = kwargs.get('succs')
+	terminals = kwargs.get('terminals')
+	if terminals is None:
+		terminals = set()
+
+	# Traces smaller than 1e-3 are dropped, so a step updates a bounded number of pairs.
+	decayFactor = gamma * lam
+	if decayFactor <= 0:
+		traceLength = 1
+	elif decayFactor >= 1:
+		traceLength = 100
+	else:
+		traceLength = min(100, int(math.ceil(math.log(1e-3) / math.log(decayFactor))))
+	traceLength = kwargs.get('traceLength', traceLength)
+	decay = [decayFactor ** k for k in range(traceLength)]
+	trace = deque(maxlen=traceLength)
+
+	def _choose(state, rows):
+		if not rows:
+			return None
+		if random.random() < max(minRnd, 1. / (tFac*(t+1))):
+			return random.choice(rows)
+		value, ac, row = q.best(state)
+		return ac, row
+
+	itr = 0
+	isTerminal = False
+	state = env.getStartingState()
+	rewardSum = 0
+	lastReward = False
+
+	choice = _choose(state, q.rows(state, env.getActions(state)))
+	while choice is not None:
+		action, row = choice
+		newState, reward, isTerminal = env.do(state, action)
+
+		lastReward = reward >= 0
+		rewards[newState] = reward
+		rewardSum += reward
+		freqs.setdefault(newState, 0)
+		freqs[newState] += 1
+
+		t, itr = t + tStep, itr + 1
+		actions = env.getActions(newState)
+		newRows = q.rows(newState, actions)
+		choice = None if isTerminal else _choose(newState, newRows)
+
+		target = reward
+		if sarsa and choice is not None:
+			target += gamma * q.values.data[choice[1]]
+		elif not sarsa and not isTerminal and newRows:
+			target += gamma * q.best(newState)[0]
+
+		step = alpha(q.visit(row)) * (target - q.values.data[row])
+		trace.appendleft((state, row))
+		values = q.values.data
+		for (s, r), d in zip(trace, decay):
+			values[r] += step * d
+
+		for s in set(s for s, r in trace):
+			utils[s], policy[s], r = q.best(s)
+
+		if planningSteps > 0:
+			if isTerminal:
+				terminals.add(newState)
+			_update_model(transs, state, action, newState, actions, isTerminal=isTerminal, **kwargs)
+			for i in range(planningSteps):
+				simRow = random.choice(q.tried)
+				simState, simAction = q.rowStates[simRow], q.rowActions[simRow]
+				n, outcomes = _outcomes(transs, simState, simAction, probs, succs)
+				target = sum(p * (rewards[s] + (0 if s in terminals else gamma * q.best(s)[0]))
+							 for s, p in outcomes)
+				q.values.data[simRow] += alpha(q.counts.data[simRow]) * (target - q.values.data[simRow])
+				utils[simState], policy[simState], r = q.best(simState)
+
+		state = newState
+		if itr >= maxItr:
+			break
+	return itr, rewardSum, lastReward
+
+
+def q_learning(env, transs={}, utils={}, freqs={}, policy={}, rewards={}, **kwargs):
+	"""
+	Model free one step Q-learning (off-policy TD control).
+
+	@param env: Environment
+	@param transs: Not used, there is no model.
+	@param utils: Utilities table (max Q of every updated state).
+	@param freqs: A table of state frequencies.
+	@param q: models.QTable with the action values, kept between trials.
+	@param Q_init: Initial action value, if q is created.
+	@param gamma: Discount factor.
+	@param tStep, tFac, minRnd, remember: GLIE exploration as in adp_random_exploration.
+	@param alpha: Step size function of N_sa.
+	@param maxItr: Maximum iterations
+	"""
+	return _td_learning(env, transs, utils, freqs, policy, rewards, False, **kwargs)
+
+
+def sarsa_lambda(env, transs={}, utils={}, freqs={}, policy={}, rewards={}, **kwargs):
+	"""
+	Model free SARSA(lambda) (on-policy TD control with eligibility traces).
+
+	@param env: Environment
+	@param lam: Trace decay lambda.
+	@param traceLength: Number of last (state, action) pairs updated in every step
+		(by default until (gamma * lam) ** k < 1e-3, at most 100).
+	Other parameters are the same as in q_learning.
+	"""
+	return _td_learning(env, transs, utils, freqs, policy, rewards, True, **kwargs)
+
+
+def dyna_q(env, transs={}, utils={}, freqs={}, policy={}, rewards={}, **kwargs):
+	"""
+	Dyna-Q: one step Q-learning on the real experience plus a fixed
+	number of backups simulated from the learned model (transs and
+	the rewards table), so the cost of a step is known in advance.
+
+	@param env: Environment
+	@param transs: A transition table (N_s'_sa), filled as by the ADP algorithms.
+	@param planningSteps: Number of simulated backups per real step.
+	Other parameters are the same as in q_learning.
+	"""
+	kwargs.setdefault('planningSteps', 10)
+	return _td_learning(env, transs, utils, freqs, policy, rewards, False, **kwargs)
+
+
 # Agent class.
 class Agent():
 	def __init__(self):
+		self.interner = None
 		self.clearExperience()
 
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def close(self):
+		"""
+		Close the interner (the files of an out-of-core store), the experience can not be used afterwards.
+		"""
+		if self.interner is not None:
+			self.interner.close()
+
 	def clearExperience(self):
+		self.close()
+
 		# Frequency table.
 		self.nTable = {}
 
@@ -270,24 +1090,161 @@ class Agent():
 		# Rewards table
 		self.rewardsTable = {}
 
+		# Running N_sa and probabilities table.
+		self.probsTable = {}
+
+		# N_sa and the single successor of every state and action, used
+		# instead of probsTable when the environment is deterministic.
+		self.succTable = {}
+
+		# Predecessors table and priority queue for prioritized sweeping.
+		self.predTable = {}
+		self.queue = PriorityQueue()
+
+		# States visited in the current trial, for the rtdp planner.
+		self.trajectory = []
+
+		# States in order of insertion and terminal states, for sweep orders.
+		self.statesList = []
+		self.terminalSet = set()
+
+		# Array backed model (models.SparseModel), only with backend='sparse'.
+		self.model = None
+
+		# State interner (interning.StateInterner), only with intern=True
+		# (storage.DiskStateInterner with store).
+		self.interner = None
+
+		# Action values (models.QTable) of the model free algorithms.
+		self.qTable = None
+
 		# history
 		self.history = []
 		
+	def save(self, path):
+		"""
+		Save the experience into a checkpoint file (see checkpoint.save).
+		"""
+		checkpoint.save(self, path)
+
+	def load(self, path, store=None):
+		"""
+		Replace the experience by the one saved in a checkpoint file (see checkpoint.load).
+		"""
+		checkpoint.load(self, path, store)
+
 	def getPolicy(self):
+		if self.interner is not None:
+			return self.interner.decodePolicy(self.policyTable)
 		return self.policyTable
 
+	def _intern(self, env, interner=None):
+		"""
+		Wrap env into a StateInterner (or the given interner, i.e.
+		storage.DiskStateInterner) and replace the per state tables
+		by its columns, the transition table by its stateDict and the
+		other tables by the ones it makes (i.e. kept on disk by a store).
+		"""
+		self.interner = interning.StateInterner(env) if interner is None else interner
+		self.transTable = self.interner.stateDict()
+		self.nTable = self.interner.table('n')
+		self.uTable = self.interner.table('utility')
+		self.policyTable = self.interner.table('action')
+		self.rewardsTable = self.interner.table('reward')
+		self.probsTable = self.interner.modelTable('probs')
+		self.succTable = self.interner.modelTable('succs')
+		self.predTable = self.interner.modelTable('preds')
+		self.statesList = self.interner.stateList()
+		self.terminalSet = self.interner.stateSet()
+		if hasattr(self.interner, 'priorityQueue'):
+			self.queue = self.interner.priorityQueue()
+		return self.interner
+
+	def _checkResume(self, kwargs):
+		"""
+		Raise ValueError if learning is resumed with other tables (intern, store,
+		backend) than the ones the experience is kept in, they would start empty.
+		"""
+		if isinstance(self.interner, storage.DiskStateInterner):
+			tables = 'store'
+		else:
+			tables = 'intern' if self.interner is not None else 'dict'
+		requested = 'store' if kwargs.get('store') is not None else 'intern' if kwargs.get('intern', False) else None
+		if requested is not None and requested != tables:
+			raise ValueError("Experience kept in %s tables can not be resumed with %s" % (tables, requested))
+		if kwargs.get('backend') == 'sparse' and self.model is None:
+			raise ValueError("Experience without a sparse model can not be resumed with backend='sparse'")
+
 	def learn(self, env, alg=adp_random_exploration, numOfTrials=150, **kwargs):
 		"""
 		Learn best policy given the environment, algorithm and number of trials.
 		@param env:
 		@param alg:
 		@param numOfTrials:
+		@param planner: Planner used by alg, i.e. 'policy_iteration', 'prioritized_sweeping',
+			'linear_policy_iteration' (exact policy evaluation) or 'rtdp'.
+		@param backend: 'dict' (default) or 'sparse' to keep the model also in a models.SparseModel.
+		@param intern: If True, states and actions are interned into integer IDs
+			and per state values are kept in arrays indexed by them. The
+			planners sweep the states in the order they were interned.
+		@param deterministic: If False, the model of a deterministic environment
+			(env.deterministic) is kept with probabilities as for stochastic ones.
+		@param store: Directory of an out-of-core store (storage.DiskStateInterner):
+			states are interned into IDs through an on-disk index, per state
+			values are kept in memory mapped arrays and the nested tables and
+			the queue in files there, only hotStates recently used states (and
+			their values) are kept in memory. Close the agent (close or a with
+			statement) to release the files.
+		@param resume: If True, the experience is not cleared, learning continues
+			from it (i.e. after load) and only the trials missing from history
+			up to numOfTrials are run. Experience of a store is loaded into store.
+			Raises ValueError if intern, store or backend='sparse' ask for other
+			tables than the ones the experience is kept in.
+		@param checkpoint: File into which the experience is saved every
+			checkpointEvery trials (default 100) and after the last one,
+			with resume it is loaded from it first if the file exists.
 		"""
 		
 		
-		itrs = 0
-		self.clearExperience()
-		for trial in range(numOfTrials):
+		checkpointPath = kwargs.get('checkpoint')
+		checkpointEvery = kwargs.get('checkpointEvery', 100)
+		if not kwargs.get('resume', False):
+			self.clearExperience()
+		elif checkpointPath is not None and os.path.exists(checkpointPath):
+			self.load(checkpointPath, kwargs.get('store'))
+		if self.history:
+			self._checkResume(kwargs)
+		itrs = sum(h['steps'] for h in self.history)
+		deterministic = getattr(env, 'deterministic', False) and kwargs.get('deterministic', True)
+		if kwargs.get('backend') == 'sparse' and self.model is None:
+			self.model = models.SparseModel()
+		if alg in (q_learning, sarsa_lambda, dyna_q) and self.qTable is None:
+			self.qTable = models.QTable(kwargs.get('Q_init', 0.))
+		if self.interner is not None:
+			# Resumed experience is keyed by the IDs of its interner.
+			self.interner.bind(env)
+			env = self.interner
+		elif kwargs.get('store') is not None:
+			env = self._intern(env, storage.DiskStateInterner(env, kwargs['store'],
+															  kwargs.get('hotStates', storage.HOT_STATES)))
+		elif kwargs.get('intern', False):
+			env = self._intern(env)
+		# The policy is tried on the environment itself, so the states visited only then are not interned.
+		solveEnv, solvePolicy = env, self.policyTable
+		if self.interner is not None:
+			solveEnv, solvePolicy = self.interner.env, interning.DecodedPolicy(self.interner, self.policyTable)
+
+		# Predecessors and terminal states are only kept if the planner, the
+		# sweep order or Dyna-Q read them. The insertion order is always kept
+		# (one append per new state), save writes the transition table in it,
+		# so a loaded table is swept in the same order as the saved one.
+		planner, order = kwargs.get('planner'), kwargs.get('order')
+		preds = self.predTable if planner in ('prioritized_sweeping', _prioritized_sweeping) or \
+								  order == 'reverse_topological' else None
+		states = self.statesList
+		terminals = self.terminalSet if order == 'reverse_topological' or alg is dyna_q or \
+										kwargs.get('planningSteps') else None
+		for trial in range(len(self.history), numOfTrials):
 			currItrs, reward, win = alg(env,
 						transs=self.transTable,
 						utils=self.uTable,
@@ -296,10 +1253,19 @@ class Agent():
 						results=self.results,
 						policy=self.policyTable,
 						rewards=self.rewardsTable,
+						probs=None if deterministic else self.probsTable,
+						succs=self.succTable if deterministic else None,
+						preds=preds,
+						queue=self.queue,
+						trajectory=self.trajectory,
+						model=self.model,
+						states=states,
+						terminals=terminals,
+						q=self.qTable,
 						**kwargs)
 			itrs += currItrs
 
-			result, energy = self.solve(env, self.getPolicy())
+			result, energy = self.solve(solveEnv, solvePolicy)
 			
 			self.history.append({
 				'reward': reward,
@@ -308,6 +1274,10 @@ class Agent():
 				'energy': energy,
 				'win': win,
 			})
+			if checkpointPath is not None and (trial + 1) % checkpointEvery == 0:
+				self.save(checkpointPath)
+		if checkpointPath is not None:
+			self.save(checkpointPath)
 		return self.getPolicy()
 
 	def solve(self, env, policy):
@@ -2,6 +2,7 @@ import environments as e
 import agents as a
 import operator
 import graph
+import runner
 
 ALGORITHMS = (
 	(a.adp_optimistic_rewards, {
@@ -39,10 +40,31 @@ ALGORITHMS = (
 			'remember': True,
 		}
 	}),
+	(a.dyna_q, {
+		e.CELJE.name: {
+			'maxItr': 20,
+			'tStep': 0.005,
+			'remember': True,
+			'planningSteps': 10,
+		},
+		e.MARIBOR.name: {
+			'maxItr': 20,
+			'tStep': 0.2,
+			'tFac': 0.9,
+			'planningSteps': 10,
+		},
+		e.LJUBLJANA.name: {
+			'maxItr': 20,
+			'tStep': 0.005,
+			'remember': True,
+			'planningSteps': 10,
+		}
+	}),
 )
 
 STOP_AFTER_ONE = True
 MAX_TESTS = 100
+PROCESSES = None # number of worker processes, None for all CPUs
 
 NUM_OF_TRIALS = {
 	e.CELJE.name: 150, #500,
@@ -74,25 +96,34 @@ graphs_funcs = {
 }
 
 def test():
+	# Learning is repeated until the solution is found (or MAX_TESTS times),
+	# in every round all (environment, algorithm) pairs without a solution are run in parallel.
+	histories = dict((env.name, {}) for env in ENVIRONMENTS)
+	rewards = {}
+	steps = 0
+	pending = [(env, alg, params) for env in ENVIRONMENTS for alg, params in ALGORITHMS]
+	# Rounds have at most len(pending) jobs, so seeds of round steps start
+	# at steps * numOfPairs and are never repeated by a later round.
+	numOfPairs = len(pending)
+	while pending and steps < (1 if STOP_AFTER_ONE else MAX_TESTS):
+		steps += 1
+		jobs = [((env, alg), env, alg, NUM_OF_TRIALS[env.name], params[env.name])
+				for env, alg, params in pending]
+		for (env, alg), (utilities, reward), history in runner.run(jobs, processes=PROCESSES, seed=steps * numOfPairs):
+			histories[env.name][alg.func_name] = history
+			rewards[(env.name, alg.func_name)] = (reward, steps)
+		pending = [(env, alg, params) for env, alg, params in pending if rewards[(env.name, alg.func_name)][0] <= 0]
+
 	for env in ENVIRONMENTS:
-		agents = {}
 		for alg, params in ALGORITHMS:
-			reward = -1
-			steps = 0
-			while reward <= 0 and steps < (1 if STOP_AFTER_ONE else MAX_TESTS):
-				steps += 1
-				agent = a.Agent()
-				agent.learn(env, alg=alg, numOfTrials=NUM_OF_TRIALS[env.name], **params[env.name])
-				test_id = (alg, env)
-				utilities, reward = agent.solve(env, agent.getPolicy())
-				agents[alg.func_name] = agent
+			reward, steps = rewards[(env.name, alg.func_name)]
 			print env.name, alg.func_name, reward, steps
 			
 		for field, funcs in graphs_funcs.iteritems():
 			for f, fun in enumerate(funcs):
 				filename = "%s-%s-%d.png" % (env.name, field, f, )
 				title="Scalability (%s) " % (field, )
-				graph.plot_agents(agents, field, show=False, fname=filename, title=title)
+				graph.plot_agents(histories[env.name], field, show=False, fname=filename, title=title)
 				
 			
 
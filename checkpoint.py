@@ -0,0 +1,394 @@
+import array
+import cPickle as pickle
+import os
+import struct
+import sys
+import zlib
+from itertools import chain, compress, groupby, islice, izip
+
+import interning
+import models
+import storage
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+
+# File header: magic, format version, CRC-32 and length of the payload.
+MAGIC = 'SOKAGENT'
+VERSION = 3
+_HEADER = struct.Struct('<8sHIQ')
+
+# Length of the pickle of every record in the payload.
+_LENGTH = struct.Struct('<Q')
+
+# Number of states (or entries of a table) per record.
+CHUNK = 1 << 14
+
+# Number of bytes of the file read at once.
+_BLOCK = 1 << 16
+
+# Per state tables of the agent: typecode and missing value of their
+# arrays and whether values are actions (numbered as well).
+_COLUMNS = (
+	('utils', 'uTable', 'd', float('nan'), False),
+	('rewards', 'rewardsTable', 'd', float('nan'), False),
+	('freqs', 'nTable', 'i', -1, False),
+	('policy', 'policyTable', 'i', -1, True),
+)
+
+# Nested tables of the agent, written as (state, value) pairs.
+_TABLES = (
+	('trans', 'transTable'),
+	('probs', 'probsTable'),
+	('succs', 'succTable'),
+	('preds', 'predTable'),
+)
+
+
+class _Numbering():
+	"""
+	Numbers objects (states or actions) in order of appearance.
+	"""
+	def __init__(self):
+		self.items = []
+		self.ids = {}
+
+	def __call__(self, item):
+		i = self.ids.get(item)
+		if i is None:
+			i = self.ids[item] = len(self.items)
+			self.items.append(item)
+		return i
+
+
+class _Inflater():
+	"""
+	Reads the zlib compressed data of file f (from its position) decompressed.
+	"""
+	def __init__(self, f):
+		self.f = f
+		self.decompressor = zlib.decompressobj()
+		self.data = ''
+		self.pos = 0
+
+	def read(self, size):
+		"""
+		Next size bytes, fewer at the end of the data.
+		"""
+		pieces = []
+		while size > 0:
+			if self.pos == len(self.data):
+				block = self.f.read(_BLOCK)
+				self.data = self.decompressor.decompress(block) if block else self.decompressor.flush()
+				self.pos = 0
+				if not self.data and not block:
+					break
+			piece = self.data[self.pos:self.pos + size]
+			self.pos += len(piece)
+			size -= len(piece)
+			pieces.append(piece)
+		return ''.join(pieces)
+
+
+def _chunks(items, size=CHUNK):
+	"""
+	Lists of up to size consecutive items of an iterable.
+	"""
+	items = iter(items)
+	while True:
+		chunk = list(islice(items, size))
+		if not chunk:
+			return
+		yield chunk
+
+
+def _column(typecode, values, size=None, missing=None):
+	"""
+	array.array of values, or of size missing values with (index, value) pairs filled in.
+	"""
+	if size is None:
+		return array.array(typecode, values)
+	column = array.array(typecode, [missing]) * size
+	for i, value in values:
+		column[i] = value
+	return column
+
+
+def _columnChunks(table, typecode, size, missing, stateId, actionCode=None):
+	"""
+	(first ID, raw array) of a per state table indexed by state ID,
+	CHUNK states at a time. Tables keyed by states are numbered with
+	stateId (and their actions with actionCode) first.
+	"""
+	if isinstance(table, storage.ColumnTable):
+		for first, values in table.column.chunks():
+			yield first, values.astype(typecode).tostring()
+		return
+	if not isinstance(table, interning.StateColumn):
+		table = _column(typecode, ((stateId(state), value if actionCode is None else actionCode(value))
+								   for state, value in table.iteritems() if value is not None), size, missing)
+	for first in xrange(0, size, CHUNK):
+		yield first, table[first:first + CHUNK].tostring()
+
+
+def _records(agent):
+	"""
+	Records (name, value) of the experience of agent (see save), the
+	states and the tables of an out-of-core store are read a chunk at a time.
+	"""
+	interner = agent.interner
+	q = agent.qTable
+	if interner is not None:
+		# Tables are already keyed by state IDs and action codes.
+		stateId = actionCode = int
+		states, actions = interner.states, interner.actions
+	else:
+		stateId, actionCode = _Numbering(), _Numbering()
+		for name, field, typecode, missing, isAction in _COLUMNS:
+			for state, value in getattr(agent, field).iteritems():
+				stateId(state)
+				if isAction and value is not None:
+					actionCode(value)
+		for state in agent.statesList:
+			stateId(state)
+		for state in agent.terminalSet:
+			stateId(state)
+		if q is not None:
+			for state, ac in izip(q.rowStates, q.rowActions):
+				stateId(state)
+				actionCode(ac)
+		states, actions = stateId.items, actionCode.items
+
+	size = len(states)
+	store = isinstance(interner, storage.DiskStateInterner)
+	yield 'meta', {
+		'byteorder': sys.byteorder,
+		'interned': interner is not None,
+		'store': (interner.path, interner.hotStates) if store else None,
+		'size': size,
+		'actions': list(actions),
+	}
+	for chunk in _chunks(states):
+		yield 'states', chunk
+
+	for name, field, typecode, missing, isAction in _COLUMNS:
+		for first, raw in _columnChunks(getattr(agent, field), typecode, size, missing, stateId,
+										actionCode if isAction else None):
+			yield name, (first, typecode, raw)
+	for chunk in _chunks(agent.statesList):
+		yield 'order', [stateId(state) for state in chunk]
+	for chunk in _chunks(agent.terminalSet):
+		yield 'terminals', [stateId(state) for state in chunk]
+
+	if store:
+		for name, field in _TABLES:
+			for chunk in _chunks(getattr(agent, field).iteritems()):
+				yield name, chunk
+	else:
+		# States of transTable are written in order of insertion (statesList),
+		# so load inserts them in the same order and the table is iterated
+		# (i.e. swept by the planners) in the same order as before saving.
+		# Tables in memory are pickled together as they are, so the states
+		# they share are pickled once.
+		transs = agent.transTable
+		ordered = set(agent.statesList)
+		tables = dict((name, getattr(agent, field)) for name, field in _TABLES)
+		tables['trans'] = [(state, transs[state]) for state in chain(agent.statesList, (state for state in transs if state not in ordered))]
+		yield 'tables', tables
+	for chunk in _chunks(agent.queue.items()):
+		yield 'queue', chunk
+
+	if q is not None:
+		columns = {
+			'state': _column('i', (stateId(state) for state in q.rowStates)),
+			'action': _column('i', (actionCode(ac) for ac in q.rowActions)),
+			'value': _column('d', q.values.view().tolist()),
+			'count': _column('i', q.counts.view().tolist()),
+			'tried': _column('i', q.tried),
+		}
+		yield 'q', (q.init, dict((name, (column.typecode, column.tostring())) for name, column in columns.iteritems()))
+	yield 'model', agent.model
+	yield 'history', (agent.history, agent.results)
+
+
+def _payload(agent):
+	"""
+	Blocks of the zlib compressed records of agent, every one is pickled after the length of its pickle.
+	"""
+	compressor = zlib.compressobj()
+	for record in _records(agent):
+		data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+		yield compressor.compress(_LENGTH.pack(len(data)) + data)
+	yield compressor.flush()
+
+
+def _array(typecode, raw, byteswap):
+	column = array.array(typecode)
+	column.fromstring(raw)
+	if byteswap:
+		column.byteswap()
+	return column
+
+
+def _fill(table, first, values, missing, keys, codes=None):
+	"""
+	Set the values of the states first.. (keys of their IDs) in a per state table, except missing ones.
+	"""
+	if isinstance(table, storage.ColumnTable):
+		table.column.data[first:first + len(values)] = np.frombuffer(values, values.typecode)
+	elif isinstance(table, interning.StateColumn):
+		table[first:first + len(values)] = values
+	else:
+		known = [value == value for value in values] if missing != missing else [value != missing for value in values]
+		values = compress(values, known)
+		table.update(izip(compress(keys[first:first + len(known)], known),
+						  values if codes is None else (codes[code] for code in values)))
+
+
+def save(agent, path):
+	"""
+	Save the experience of agent (agents.Agent) into path.
+
+	The payload is a sequence of records, every one pickled on its own,
+	compressed with zlib together and stored after a header with a CRC-32
+	of the payload. States and actions are numbered (interned ones are
+	numbered already), every per state table is stored as flat arrays
+	(array.array) indexed by state ID, the nested tables (transition
+	counts, probabilities, successors of deterministic environments,
+	predecessors) are pickled together as they are and the priorities
+	of the prioritized sweeping queue as (state, priority) pairs. States,
+	arrays and pairs are written CHUNK states per record, the nested
+	tables of an out-of-core store as (state ID, value) pairs as well,
+	so its states and tables are never all in memory.
+
+	The file is written under a temporary name and then renamed, so
+	a process which dies while saving leaves the previous checkpoint.
+	"""
+	tmpPath = path + '.tmp'
+	with open(tmpPath, 'wb') as f:
+		f.write(_HEADER.pack(MAGIC, VERSION, 0, 0))
+		crc, length = 0, 0
+		for block in _payload(agent):
+			f.write(block)
+			crc = zlib.crc32(block, crc)
+			length += len(block)
+		f.seek(0)
+		f.write(_HEADER.pack(MAGIC, VERSION, crc & 0xffffffff, length))
+	os.rename(tmpPath, path)
+
+
+def _read(f):
+	"""
+	Records of the payload in file f (from its position), one at a time.
+	"""
+	inflater = _Inflater(f)
+	while True:
+		length = inflater.read(_LENGTH.size)
+		if not length:
+			return
+		yield pickle.loads(inflater.read(_LENGTH.unpack(length)[0]))
+
+
+def _states(records, size):
+	"""
+	The size states of the next records.
+	"""
+	while size > 0:
+		name, chunk = next(records)
+		for state in chunk:
+			yield state
+		size -= len(chunk)
+
+
+def load(agent, path, store=None):
+	"""
+	Replace the experience of agent (agents.Agent) by the one saved in
+	path with save. The records are read one at a time, the per state
+	tables are filled from their arrays in bulk. The experience of an
+	out-of-core store is restored into a storage.DiskStateInterner in
+	directory store (by default the one it was saved from).
+
+	Raises ValueError if path is not a checkpoint or its checksum does not match.
+	"""
+	with open(path, 'rb') as f:
+		header = f.read(_HEADER.size)
+		if len(header) < _HEADER.size:
+			raise ValueError("%s is not an agent checkpoint" % path)
+		magic, version, crc, length = _HEADER.unpack(header)
+		if magic != MAGIC:
+			raise ValueError("%s is not an agent checkpoint" % path)
+		if version != VERSION:
+			raise ValueError("Unsupported checkpoint version %d in %s" % (version, path))
+
+		# The whole payload is checked before the experience is replaced.
+		payloadCrc, payloadLength = 0, 0
+		for block in iter(lambda: f.read(_BLOCK), ''):
+			payloadCrc = zlib.crc32(block, payloadCrc)
+			payloadLength += len(block)
+		if payloadLength != length or payloadCrc & 0xffffffff != crc:
+			raise ValueError("Checkpoint %s is corrupted (checksum mismatch)" % path)
+		f.seek(_HEADER.size)
+
+		records = _read(f)
+		name, meta = next(records)
+		byteswap = meta['byteorder'] != sys.byteorder
+		size, actions = meta['size'], meta['actions']
+		states = _states(records, size)
+
+		agent.clearExperience()
+		if meta['interned']:
+			# The interner is bound to an environment when learning continues.
+			if meta['store'] is not None:
+				storePath, hotStates = meta['store']
+				interner = agent._intern(None, storage.DiskStateInterner(None, store or storePath, hotStates))
+			else:
+				interner = agent._intern(None)
+			interner.restore(states, actions)
+			keys, codes = xrange(size), xrange(len(actions))
+		else:
+			keys, codes = list(states), actions
+
+		columns = dict((name, (getattr(agent, field), missing, codes if isAction else None))
+					   for name, field, typecode, missing, isAction in _COLUMNS)
+		tables = dict((name, getattr(agent, field)) for name, field in _TABLES)
+		for name, value in records:
+			if name in columns:
+				table, missing, decode = columns[name]
+				first, typecode, raw = value
+				_fill(table, first, _array(typecode, raw, byteswap), missing, keys, decode)
+			elif name in tables:
+				# States are set one by one, a store keeps its tables on disk.
+				table = tables[name]
+				for state, entry in value:
+					table[state] = entry
+			elif name == 'tables':
+				for state, acts in value.pop('trans'):
+					agent.transTable[state] = acts
+				for name, field in _TABLES[1:]:
+					setattr(agent, field, value[name])
+			elif name == 'order':
+				agent.statesList.extend(keys[sid] for sid in value)
+			elif name == 'terminals':
+				agent.terminalSet.update(keys[sid] for sid in value)
+			elif name == 'queue':
+				agent.queue.update(value)
+			elif name == 'q':
+				init, raws = value
+				q = agent.qTable = models.QTable(init)
+				q.rowStates = [keys[sid] for sid in _array(raws['state'][0], raws['state'][1], byteswap)]
+				q.rowActions = [codes[code] for code in _array(raws['action'][0], raws['action'][1], byteswap)]
+				q.tried = _array(raws['tried'][0], raws['tried'][1], byteswap).tolist()
+				if q.rowStates:
+					q.values.data = np.frombuffer(_array(raws['value'][0], raws['value'][1], byteswap), np.float64).copy()
+					q.counts.data = np.frombuffer(_array(raws['count'][0], raws['count'][1], byteswap), np.int32).astype(np.int64)
+					q.values.size = q.counts.size = len(q.rowStates)
+				# Rows of a state are added together, so they are consecutive.
+				for state, rows in groupby(xrange(len(q.rowStates)), q.rowStates.__getitem__):
+					q.stateRows[state] = tuple((q.rowActions[row], row) for row in rows)
+			elif name == 'model':
+				agent.model = value
+			elif name == 'history':
+				agent.history, agent.results = value
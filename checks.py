@@ -0,0 +1,63 @@
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+import environments as env
+import agents as ag
+
+
+def sparse_planner():
+	"""
+	The sparse (array backed) planner has to learn exactly the same as the dict one.
+	"""
+	agents = []
+	for options in ({}, {'planner': 'sparse_policy_iteration', 'backend': 'sparse'}):
+		random.seed(0)
+		agents.append(ag.Agent())
+		agents[-1].learn(env.MARIBOR, alg=ag.adp_random_exploration, numOfTrials=30, maxItr=30, **options)
+	same = agents[0].history == agents[1].history and agents[0].uTable == agents[1].uTable and \
+		   agents[0].getPolicy() == agents[1].getPolicy()
+	print "Sparse planner matches policy iteration: " + str(same)
+	return same
+
+
+def checkpoint_resume():
+	"""
+	An agent saved after a plain learn (without checkpoint), loaded into a
+	new agent and resumed has to learn exactly the same as without saving.
+	"""
+	directory = tempfile.mkdtemp()
+	path = os.path.join(directory, 'agent.ckpt')
+	same = True
+	try:
+		for options in ({}, {'intern': True}, {'backend': 'sparse'}):
+			random.seed(1)
+			full = ag.Agent()
+			full.learn(env.MARIBOR, alg=ag.adp_random_exploration, numOfTrials=20, **options)
+			random.seed(1)
+			part = ag.Agent()
+			part.learn(env.MARIBOR, alg=ag.adp_random_exploration, numOfTrials=10, **options)
+			part.save(path)
+			state = random.getstate()
+			resumed = ag.Agent()
+			resumed.load(path)
+			random.setstate(state)
+			resumed.learn(env.MARIBOR, alg=ag.adp_random_exploration, numOfTrials=20, resume=True, **options)
+			same = same and full.history == resumed.history and full.getPolicy() == resumed.getPolicy()
+	finally:
+		shutil.rmtree(directory)
+	print "Resumed checkpoint matches uninterrupted learning: " + str(same)
+	return same
+
+
+CHECKS = (
+	sparse_planner,
+	checkpoint_resume,
+)
+
+if __name__ == '__main__':
+	# Every check is run, the exit status tells whether they all passed.
+	results = [check() for check in CHECKS]
+	sys.exit(0 if all(results) else 1)
@@ -2,7 +2,21 @@ __author__ = 'Ziga Stopinsek & Jernej Jerin'
 import random
 from itertools import groupby
 
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+# Codes of cells in the occupancy grid of Maze.
+FLOOR = 0
+STONE = 1
+END_PLUS = 2
+END_MINUS = 3
+
 class Environment():
+	# Whether do always returns the same result for the same state and action.
+	deterministic = False
+
 	def __init__(self):
 		raise NotImplementedError("__init__")
 
@@ -15,6 +29,21 @@ class Environment():
 	def getActions(self, state):
 		raise NotImplementedError("getActions")
 
+	def enableCache(self, size=None):
+		"""
+		Results of do are random, so they are never cached
+		(see environments.Environment.enableCache).
+
+		@return: False, the cache is not used.
+		"""
+		return False
+
+	def invalidateCache(self):
+		pass
+
+	def disableCache(self):
+		pass
+
 
 class Maze(Environment):
 	def __init__(
@@ -64,6 +93,38 @@ class Maze(Environment):
 			"left": self.possible_actions[2],
 			"right": self.possible_actions[3],
 		}
+		self._init_grid()
+
+	def _init_grid(self):
+		"""
+		Occupancy grid with a code (FLOOR, STONE, END_PLUS, END_MINUS)
+		for every cell, so a cell is looked up in O(1) instead of in
+		the sorted lists. It is a NumPy array, or a list of bytearray
+		rows if NumPy is not installed; both are indexed as grid[i][j].
+
+		@return:
+		"""
+		if np is not None:
+			self.grid = np.zeros(self.size, dtype=np.int8)
+		else:
+			self.grid = [bytearray(self.size[1]) for i in range(self.size[0])]
+		for code, positions in ((STONE, self.stone_pos_set),
+								(END_PLUS, self.end_plus_pos_set),
+								(END_MINUS, self.end_minus_pos_set)):
+			for i, j in positions:
+				self.grid[i][j] = code
+
+	def _cell(self, pos):
+		"""
+		Code of the cell at pos, cells outside of the environment are stones.
+
+		@param pos:
+		@return:
+		"""
+		i, j = pos
+		if 0 <= i < self.size[0] and 0 <= j < self.size[1]:
+			return self.grid[i][j]
+		return STONE
 
 	def _init_from_image(self, image):
 		"""
@@ -116,6 +177,7 @@ class Maze(Environment):
 		@return:
 		"""
 		agent_pos = state[0]
+		chars = {FLOOR: " ", STONE: "#", END_PLUS: "+", END_MINUS: "-"}
 
 		# Over rows.
 		for i in range(self.size[0]):
@@ -126,14 +188,8 @@ class Maze(Environment):
 				pt = (self.size[0] - i - 1, j)
 				if pt == agent_pos:
 					line += "A"
-				elif pt in self.end_plus_pos_set:
-					line += "+"
-				elif pt in self.end_minus_pos_set:
-					line += "-"
-				elif pt in self.stone_pos_set:
-					line += "#"
 				else:
-					line += " "
+					line += chars[self._cell(pt)]
 			print line
 
 
@@ -146,6 +202,7 @@ class Maze(Environment):
 		"""
 
 		pol_dir = {(1, 0): '^', (0, 1): '>', (-1, 0): 'v', (0, -1): '<', None: ' '}
+		chars = {STONE: "#", END_PLUS: "+", END_MINUS: "-"}
 
 		# Over rows.
 		for i in range(self.size[0]):
@@ -155,12 +212,9 @@ class Maze(Environment):
 			for j in range(self.size[1]):
 				# Change column and row order.
 				pt = (self.size[0] - i - 1, j)
-				if pt in self.end_plus_pos_set:
-					line += "+"
-				elif pt in self.end_minus_pos_set:
-					line += "-"
-				elif pt in self.stone_pos_set:
-					line += "#"
+				cell = self._cell(pt)
+				if cell != FLOOR:
+					line += chars[cell]
 				elif (pt,) in policy:
 					line += pol_dir.get(policy.get((pt,)))
 				else:
@@ -200,24 +254,53 @@ class Maze(Environment):
 		new_pos = self._add(agent_pos, action)
 
 		# Are we in stone?
-		if new_pos in self.stone_pos_set:
+		if self._blocked(new_pos):
 			new_pos = agent_pos
 
-		reward = -0.04  # For evey additional move the agent gets negative points.
-		is_terminal_state = False
+		reward, is_terminal_state = self._reward(new_pos)
+
+		# First position is new position of a player.
+		return (new_pos, ), reward, is_terminal_state
+
+	def _reward(self, pos):
+		"""
+		Reward for entering position pos and whether pos is terminal.
+
+		@param pos:
+		@return:
+		"""
+		cell = self._cell(pos)
 
 		# Check if we are in one of the positive positions.
-		if new_pos in self.end_plus_pos_set:
-			reward = 1
-			is_terminal_state = True
+		if cell == END_PLUS:
+			return 1, True
 
 		# Check if we are in one of the negative positions.
-		elif new_pos in self.end_minus_pos_set:
-			reward = -1
-			is_terminal_state = True
+		if cell == END_MINUS:
+			return -1, True
 
-		# First position is new position of a player.
-		return (new_pos, ), reward, is_terminal_state
+		# For evey additional move the agent gets negative points.
+		return -0.04, False
+
+	def _blocked(self, pos):
+		"""
+		Check if pos is a stone or outside of the environment.
+
+		@param pos:
+		@return:
+		"""
+		return self._cell(pos) == STONE
+
+	def _slips(self, relative):
+		"""
+		The two directions at right angles to the intended direction relative.
+
+		@param relative:
+		@return:
+		"""
+		if relative[0] != 0:
+			return (0, 1), (0, -1)
+		return (1, 0), (-1, 0)
 
 	def _add(self, absolute, relative):
 		"""
@@ -235,19 +318,13 @@ class Maze(Environment):
 
 		if rand > 0.2:
 			# With probability of 0.8.
-			new_pos = absolute[0] + relative[0], absolute[1] + relative[1]
+			move = relative
+		elif rand > 0.1:
+			move = self._slips(relative)[0]
 		else:
-			if relative[0] == 1:
-				if 0.1 < rand <= 0.2:
-					new_pos = absolute[0], absolute[1] + 1
-				else:
-					new_pos = absolute[0], absolute[1] - 1
-			else:
-				if 0.1 < rand <= 0.2:
-					new_pos = absolute[0] + 1, absolute[1]
-				else:
-					new_pos = absolute[0] - 1, absolute[1]
-		if new_pos in self.stone_pos_set:
+			move = self._slips(relative)[1]
+		new_pos = absolute[0] + move[0], absolute[1] + move[1]
+		if self._blocked(new_pos):
 			new_pos = absolute[0], absolute[1]
 		return new_pos
 
@@ -266,7 +343,7 @@ class Maze(Environment):
 			new_pos = agent_pos[0] + action[0], agent_pos[1] + action[1]
 
 			# Check for wall.
-			if new_pos in self.stone_pos_set:
+			if self._blocked(new_pos):
 				continue
 
 			# Everything is OK!
@@ -274,6 +351,174 @@ class Maze(Environment):
 
 		return actions
 
+	def transition_model(self):
+		"""
+		The known model of the environment as NumPy arrays. States are
+		the agent positions which are not stones, in order of rows
+		then columns, actions are in the order of possible_actions.
+		Every action has three outcomes k (intended, then the two at
+		right angles, as in _add):
+
+		next_states[a, s, k]: index of the state reached with outcome k,
+		probs[a, s, k]: its probability (0.8, 0.1, 0.1),
+		rewards[s]: reward for entering state s,
+		terminal[s]: whether state s is terminal,
+		allowed[a, s]: whether action a is in getActions of state s.
+
+		@return: (states, next_states, probs, rewards, terminal, allowed)
+		"""
+		if np is None:
+			raise ImportError("transition_model requires numpy")
+		grid = np.asarray(self.grid)
+		rows, cols = np.nonzero(grid != STONE)
+		num_states, num_actions = len(rows), len(self.possible_actions)
+
+		# State index of every cell, -1 for stones and for the padding around the grid.
+		index = np.full((self.size[0] + 2, self.size[1] + 2), -1, dtype=np.int64)
+		index[rows + 1, cols + 1] = np.arange(num_states)
+
+		next_states = np.zeros((num_actions, num_states, 3), dtype=np.int64)
+		probs = np.tile(np.array([0.8, 0.1, 0.1]), (num_actions, num_states, 1))
+		allowed = np.zeros((num_actions, num_states), dtype=np.bool_)
+		for a, action in enumerate(self.possible_actions):
+			moves = (action, ) + self._slips(action)
+			for k, move in enumerate(moves):
+				target = index[rows + 1 + move[0], cols + 1 + move[1]]
+				blocked = target < 0
+				next_states[a, :, k] = np.where(blocked, np.arange(num_states), target)
+				if k == 0:
+					allowed[a] = ~blocked
+
+		codes = grid[rows, cols]
+		rewards = np.where(codes == END_PLUS, 1., np.where(codes == END_MINUS, -1., -0.04))
+		terminal = (codes == END_PLUS) | (codes == END_MINUS)
+		states = [((i, j), ) for i, j in zip(rows.tolist(), cols.tolist())]
+		return states, next_states, probs, rewards, terminal, allowed
+
+	def transition_tensor(self):
+		"""
+		Dense transition tensor T[a, s, s'] = P(s'|s, a) over the states
+		and actions of transition_model.
+
+		@return: (states, T)
+		"""
+		states, next_states, probs, rewards, terminal, allowed = self.transition_model()
+		tensor = np.zeros(next_states.shape[:2] + (len(states), ))
+		a, s = np.indices(next_states.shape[:2])
+		for k in range(next_states.shape[2]):
+			np.add.at(tensor, (a, s, next_states[:, :, k]), probs[:, :, k])
+		return states, tensor
+
+	def solve(self, method='value_iteration', gamma=1., epsilon=1e-6, max_iterations=10000, eval_sweeps=20):
+		"""
+		Optimal policy and utilities for the known model, computed with
+		vectorized value iteration or (modified) policy iteration:
+		U(s) = R(s) + gamma * max_a sum_s' P(s'|s, a) U(s') and U(s) = R(s)
+		in terminal states. Only actions from getActions are considered,
+		ties are broken in the order of possible_actions.
+
+		@param method: 'value_iteration' or 'policy_iteration'.
+		@param gamma: Discount factor.
+		@param epsilon: Stop when the largest utility change is at most epsilon.
+		@param max_iterations: Maximum number of iterations.
+		@param eval_sweeps: Number of evaluation sweeps per policy iteration.
+		@return: (policy, utilities), both keyed by states as the agents keep them,
+			the policy only for states which are not terminal.
+		"""
+		states, next_states, probs, rewards, terminal, allowed = self.transition_model()
+		continuing = gamma * ~terminal
+		utils = rewards.copy()
+
+		def _q_values(utils):
+			q_values = (probs * utils[next_states]).sum(axis=2)
+			q_values[~allowed] = -np.inf
+			return q_values
+
+		if method == 'value_iteration':
+			for iteration in range(max_iterations):
+				new_utils = rewards + continuing * _q_values(utils).max(axis=0)
+				delta = np.abs(new_utils - utils).max()
+				utils = new_utils
+				if delta <= epsilon:
+					break
+			actions = _q_values(utils).argmax(axis=0)
+		elif method == 'policy_iteration':
+			actions = _q_values(utils).argmax(axis=0)
+			columns = np.arange(len(states))
+			for iteration in range(max_iterations):
+				# Evaluate the current policy with a few sweeps, then improve it.
+				old_utils = utils
+				for sweep in range(eval_sweeps):
+					utils = rewards + continuing * (probs[actions, columns] * utils[next_states[actions, columns]]).sum(axis=1)
+				q_values = _q_values(utils)
+				new_actions = q_values.argmax(axis=0)
+
+				# Keep the current action on ties, so the policy can become stable.
+				keep = q_values[actions, columns] >= q_values[new_actions, columns]
+				new_actions[keep] = actions[keep]
+				stable = (new_actions == actions).all()
+				actions = new_actions
+				if stable and np.abs(utils - old_utils).max() <= epsilon:
+					break
+		else:
+			raise ValueError("Unknown method: %s" % method)
+
+		policy = dict((state, self.possible_actions[actions[s]])
+					  for s, state in enumerate(states) if not terminal[s] and allowed[:, s].any())
+		return policy, dict(zip(states, utils.tolist()))
+
+def generate_maze(size=(101, 101), seed=None, loops=0., pits=0):
+	"""
+	Procedurally generated maze. Corridors are carved with a randomized
+	depth first search between the cells with odd coordinates, so the
+	maze is surrounded by stones and every corridor cell is reachable.
+	The agent starts at (1, 1) and the positive end position is the
+	corridor cell in the opposite corner.
+
+	@param size: (rows, columns), odd numbers give stones on all sides.
+	@param seed: Seed of the generator, the same seed gives the same maze.
+	@param loops: Probability that an inner stone between two corridors is
+		removed, so there is more than one way to the end.
+	@param pits: Number of negative end positions on random corridor cells.
+	@return: Maze
+	"""
+	rnd = random.Random(seed)
+	rows, cols = size
+	carved = [bytearray(cols) for i in range(rows)]
+
+	carved[1][1] = 1
+	stack = [(1, 1)]
+	while stack:
+		i, j = stack[-1]
+		neighbors = [(i + di, j + dj) for di, dj in ((2, 0), (-2, 0), (0, 2), (0, -2))
+					 if 0 < i + di < rows - 1 and 0 < j + dj < cols - 1 and not carved[i + di][j + dj]]
+		if not neighbors:
+			stack.pop()
+			continue
+		ni, nj = rnd.choice(neighbors)
+		carved[(i + ni) // 2][(j + nj) // 2] = 1
+		carved[ni][nj] = 1
+		stack.append((ni, nj))
+
+	if loops > 0:
+		for i in range(1, rows - 1):
+			for j in range(1, cols - 1):
+				if not carved[i][j] and (i + j) % 2 == 1 and rnd.random() < loops and \
+				   (carved[i - 1][j] and carved[i + 1][j] or carved[i][j - 1] and carved[i][j + 1]):
+					carved[i][j] = 1
+
+	start = (1, 1)
+	end = (range(1, rows - 1, 2)[-1], range(1, cols - 1, 2)[-1])
+	corridor = [(i, j) for i in range(rows) for j in range(cols)
+				if carved[i][j] and (i, j) != start and (i, j) != end]
+	return Maze(
+		size_or_image=size,
+		agent_pos=start,
+		end_plus_pos_list=[end],
+		end_minus_pos_list=rnd.sample(corridor, min(pits, len(corridor))),
+		stone_pos_list=[(i, j) for i in range(rows) for j in range(cols) if not carved[i][j]]
+	)
+
 # The environment is mathematically defined.
 example1 = Maze(
 	size_or_image=(5, 5),
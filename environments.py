@@ -1,15 +1,106 @@
+from collections import deque, OrderedDict
 from itertools import groupby
 
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
 REWARD_DEFAULT = -2
 REWARD_MOVE_BOX = -1
 REWARD_BOX_ON_END = 15
 REWARD_DEADLOCK = -2000
 REWARD_SOLVED = 200
 
+# Number of box configurations remembered by the freeze and matching deadlock detectors.
+DEADLOCK_CACHE_SIZE = 100000
+
+# Number of box configurations remembered by PushSokoban for canonical agent squares.
+REGION_CACHE_SIZE = 100000
+
+# Default number of do and getActions results kept by Environment.enableCache.
+TRANSITION_CACHE_SIZE = 200000
+
+
+class TransitionCache():
+	"""
+	Bounded LRU cache of environment results. When it is full the
+	least recently used result is forgotten. hits and misses count
+	how many results were found and how many had to be computed.
+	"""
+	def __init__(self, size=TRANSITION_CACHE_SIZE):
+		self.size = size
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+	def __len__(self):
+		return len(self.entries)
+
+	def get(self, key, fun, *args):
+		entries = self.entries
+		try:
+			value = entries.pop(key)
+			self.hits += 1
+		except KeyError:
+			value = fun(*args)
+			self.misses += 1
+			if len(entries) >= self.size:
+				entries.popitem(last=False)
+		entries[key] = value
+		return value
+
+	def clear(self):
+		self.entries.clear()
+
+
 class Environment():
+	# Whether do always returns the same result for the same state and action.
+	deterministic = False
+
+	# TransitionCache used by do and getActions, see enableCache.
+	cache = None
+
 	def __init__(self):
 		raise NotImplementedError("__init__")
 
+	def __getstate__(self):
+		# Cached methods are not picklable, a copy starts without the cache.
+		state = self.__dict__.copy()
+		for name in ('do', 'getActions', 'cache'):
+			state.pop(name, None)
+		return state
+
+	def enableCache(self, size=TRANSITION_CACHE_SIZE):
+		"""
+		Remember results of do and getActions in a bounded LRU cache,
+		so a (state, action) pair is simulated only once. Only
+		deterministic environments are cached, for the others
+		nothing changes.
+
+		@param size: Maximum number of remembered results.
+		@return: True if the cache is used.
+		"""
+		if not self.deterministic:
+			return False
+		self.disableCache()
+		cache = self.cache = TransitionCache(size)
+		do, getActions = self.do, self.getActions
+		self.do = lambda state, action: cache.get(('do', state, action), do, state, action)
+		self.getActions = lambda state: list(cache.get(('actions', state), _tupled, getActions, state))
+		return True
+
+	def invalidateCache(self):
+		"""
+		Forget all cached results, for instance after the level was changed.
+		"""
+		if self.cache is not None:
+			self.cache.clear()
+
+	def disableCache(self):
+		for name in ('do', 'getActions', 'cache'):
+			self.__dict__.pop(name, None)
+
 	def getStartingState(self):
 		raise NotImplementedError("getStartingState")
 
@@ -20,14 +111,58 @@ class Environment():
 		raise NotImplementedError("getActions")
 
 
+def _tupled(fun, *args):
+	return tuple(fun(*args))
+
+
+class Level():
+	"""
+	Static part of a Sokoban level (stones, borders, goals) compiled
+	once into lookup tables, no matter if the level was given as an
+	image or with coordinates. do, getActions and the deadlock rules
+	only index them instead of checking borders and stones again.
+	"""
+	def __init__(self, env):
+		# Squares inside borders which are not stones, columns then rows.
+		self.floor = [(i, j) for i in range(env.size[0]) for j in range(env.size[1])
+					  if (i, j) not in env.stonePosSet]
+
+		# For every action: floor square => neighbor floor square in that
+		# direction. Squares next to a stone or a border are left out.
+		self.steps = {}
+		for diff in env.possibleActions:
+			step = self.steps[diff] = {}
+			for pos in self.floor:
+				newPos = env._add(pos, diff)
+				if env._free(newPos):
+					step[pos] = newPos
+
+		self.goals = frozenset(env.endPosSet)
+		self.corners = frozenset(pos for pos in self.floor if env._in_corner(pos))
+		self.edges = frozenset(pos for pos in self.floor if env._on_edge(pos))
+
+		# Number of goals on the edges, used by the edge rule of _simple_deadlock.
+		self.goalsOnEdge = sum(env._on_edge(loc) for loc in env.endPosSet)
+
+
 class Sokoban(Environment):
+	deterministic = True
+
 	def __init__(self, name, 
 				 size_or_image=(5, 5),
 				 agentPos=(0, 0),
 				 boxPosList=[],
 				 endPosList=[],
-				 stonePosList=[]):
+				 stonePosList=[],
+				 deadlocks=('dead_squares', )):
+		"""
+		@param deadlocks: Deadlock detectors used by do: 'dead_squares' (box pushed
+			onto a square from which no goal can be reached), 'simple' (the corner
+			and edge rules), 'freeze' (boxes blocking each other along both axes)
+			and 'matching' (boxes cannot be assigned to different reachable goals).
+		"""
 		self.name = name
+		self.deadlocks = deadlocks
 		if (type(size_or_image) in [str, unicode]):
 			# If contains image of environment.
 			self._init_from_image(size_or_image.split("\n"))
@@ -64,6 +199,85 @@ class Sokoban(Environment):
 		# define environment corners for terminal state detection
 		self.envCorners = {(0, 0, ), (0, n, ), (m, 0, ), (m, n, )}
 
+		self.level = Level(self)
+
+		# Squares from which a box can never reach a goal, computed once per level.
+		# Pushes from every square to each goal, squares from which a box
+		# can reach each goal (boxGoals is the reverse) and pushes to the nearest goal.
+		self.pushDistances = dict((goal, self._push_distances(goal)) for goal in self.endPosSet)
+		self.goalReach = dict((goal, set(dist)) for goal, dist in self.pushDistances.iteritems())
+		self.goalDistance = {}
+		for dist in self.pushDistances.itervalues():
+			for loc, pushes in dist.iteritems():
+				self.goalDistance[loc] = min(pushes, self.goalDistance.get(loc, pushes))
+		self.boxGoals = {}
+		for goal, reach in self.goalReach.iteritems():
+			for loc in reach:
+				self.boxGoals.setdefault(loc, []).append(goal)
+		self.deadSquares = self._dead_squares()
+
+		# Results of freeze and matching detectors per box configuration.
+		self.deadlockCache = {}
+
+	def _free(self, loc):
+		return self._in_borders(loc) and loc not in self.stonePosSet
+
+	def _push_distances(self, goal):
+		"""
+		Find the minimal number of pushes from every square from which
+		a box can be pushed onto goal when there are no other boxes.
+		The box is pulled backwards from the goal (breadth first): it
+		can be pulled from loc to loc + diff if the agent can stand on
+		loc + diff and step further to loc + 2 * diff.
+		"""
+		if not self._free(goal):
+			return {}
+		steps = self.level.steps
+		dist = {goal: 0}
+		layer = [goal]
+		while layer:
+			nextLayer = []
+			for loc in layer:
+				for diff in self.possibleActions:
+					prev = steps[diff].get(loc)
+					if prev is not None and prev not in dist and prev in steps[diff]:
+						dist[prev] = dist[loc] + 1
+						nextLayer.append(prev)
+			layer = nextLayer
+		return dist
+
+	def optimisticValue(self, state, action=None):
+		"""
+		Optimistic estimate of the reward of the pushes still needed in
+		state: every box is pushed straight to its nearest goal, ignoring
+		the other boxes and the walking between pushes, for REWARD_MOVE_BOX
+		per push. REWARD_DEADLOCK if a box can never reach a goal.
+		If action is given, the estimate of the state it leads to
+		(REWARD_DEADLOCK if do finds a deadlock there).
+		Used by adp_optimistic_rewards instead of a constant R_plus.
+		"""
+		if action is not None:
+			state, reward, isTerminalState = self.do(state, action)
+			if isTerminalState and reward < 0:
+				return REWARD_DEADLOCK
+		return self._pushesValue(state)
+
+	def _pushesValue(self, state):
+		pushes = 0
+		for box in state[1:]:
+			if box not in self.goalDistance:
+				return REWARD_DEADLOCK
+			pushes += self.goalDistance[box]
+		return REWARD_MOVE_BOX * pushes
+
+	def _dead_squares(self):
+		"""
+		Find all free squares from which a box cannot be pushed onto
+		any goal, even when there are no other boxes.
+		"""
+		return set((i, j) for i in range(self.size[0]) for j in range(self.size[1])
+				   if self._free((i, j)) and (i, j) not in self.boxGoals)
+
 	def _init_from_image(self, image):
 		boxPosList = [] # TODO: sort?
 		agentPos = [None, None, ]
@@ -185,7 +399,9 @@ class Sokoban(Environment):
 
 		agentPos = state[0]
 		boxPosSet = set(state[1:]) # set optimizes search
-		newPos = self._add(agentPos, action) # get new position with respect to action. We have already checked whether this action is possible.
+		step = self.level.steps[action]
+		goals = self.level.goals
+		newPos = step.get(agentPos) or self._add(agentPos, action) # get new position with respect to action. We have already checked whether this action is possible.
 		boxList = [] # new box positions
 		reward = REWARD_DEFAULT # agent reward. For evey additional move the agent gets negative points.
 		isTerminalState = False
@@ -196,11 +412,11 @@ class Sokoban(Environment):
 			for boxPos in boxPosSet:
 				# check if new position moves a box
 				if boxPos == newPos:
-					newBoxPos = self._add(boxPos, action)
+					newBoxPos = step.get(boxPos) or self._add(boxPos, action)
 
 					# Reward for moving a box.
 					reward = REWARD_MOVE_BOX
-					if newBoxPos in self.endPosSet:
+					if newBoxPos in goals:
 						# If new position is in end position then we give greater reward.
 						reward = REWARD_BOX_ON_END
 					boxList.append(newBoxPos)
@@ -215,10 +431,10 @@ class Sokoban(Environment):
 		if deadlock:
 			reward = REWARD_DEADLOCK
 			isTerminalState = True
-		boxInEndPosCount = sum(box in self.endPosSet for box in boxList)
+		boxInEndPosCount = sum(box in goals for box in boxList)
 
 		# check if we are finished
-		if boxInEndPosCount == len(self.endPosSet):
+		if boxInEndPosCount == len(goals):
 			reward = REWARD_SOLVED
 			isTerminalState = True
 
@@ -260,7 +476,92 @@ class Sokoban(Environment):
 
 	def _deadlock_detection(self, newBoxPos, boxList):
 		"""
-		Detecting deadlock positions in sokoban.
+		Detecting deadlock positions in sokoban with the detectors
+		selected in self.deadlocks.
+		"""
+		if 'dead_squares' in self.deadlocks and newBoxPos in self.deadSquares:
+			return True
+		if 'simple' in self.deadlocks and self._simple_deadlock(newBoxPos, boxList):
+			return True
+		if newBoxPos is not None and ('freeze' in self.deadlocks or 'matching' in self.deadlocks):
+			boxes = tuple(sorted(boxList))
+			deadlock = self.deadlockCache.get(boxes)
+			if deadlock is None:
+				deadlock = self._remember_deadlock(boxes, self._config_deadlock(boxes))
+			return deadlock
+		return False
+
+	def _remember_deadlock(self, key, deadlock):
+		if len(self.deadlockCache) >= DEADLOCK_CACHE_SIZE:
+			self.deadlockCache.clear()
+		self.deadlockCache[key] = deadlock
+		return deadlock
+
+	def _config_deadlock(self, boxes):
+		"""
+		Freeze and matching deadlocks of box configuration boxes.
+		They do not depend on the agent, so do caches them per configuration.
+		"""
+		if 'freeze' in self.deadlocks and self._freeze_deadlock(set(boxes)):
+			return True
+		if 'matching' in self.deadlocks and not self._matching_exists(boxes):
+			return True
+		return False
+
+	def _freeze_deadlock(self, boxSet):
+		"""
+		Freeze deadlock: some box which is not on a goal can never
+		be moved again, because along both axes it is blocked by a
+		stone, by dead squares on both sides or by another frozen box.
+		"""
+		for box in boxSet:
+			if box not in self.endPosSet and self._frozen(box, boxSet, set()):
+				return True
+		return False
+
+	def _frozen(self, box, boxSet, visited):
+		"""
+		Check if box cannot move along either axis. Boxes which are
+		already being checked (visited) are treated as stones.
+		"""
+		visited.add(box)
+		for first, second in ((self.possibleActions[0], self.possibleActions[1]),
+							  (self.possibleActions[2], self.possibleActions[3])):
+			locs = self._add(box, first), self._add(box, second)
+			if not self._free(locs[0]) or not self._free(locs[1]):
+				continue
+			if locs[0] in self.deadSquares and locs[1] in self.deadSquares:
+				continue
+			if any(loc in boxSet and (loc in visited or self._frozen(loc, boxSet, visited))
+				   for loc in locs):
+				continue
+			return False
+		return True
+
+	def _matching_exists(self, boxes):
+		"""
+		Check if boxes can be assigned to different goals, each box to
+		a goal it can reach (maximum bipartite matching with augmenting
+		paths). Other boxes are ignored, so a missing matching means
+		that the configuration can never be solved.
+		"""
+		match = {} # goal => box
+
+		def _augment(box, seen):
+			for goal in self.boxGoals.get(box, ()):
+				if goal not in seen:
+					seen.add(goal)
+					if goal not in match or _augment(match[goal], seen):
+						match[goal] = box
+						return True
+			return False
+
+		matched = sum(_augment(box, set()) for box in boxes)
+		return matched >= min(len(boxes), len(self.endPosSet))
+
+	def _simple_deadlock(self, newBoxPos, boxList):
+		"""
+		Corner and edge rules.
 		"""
 		# IN THIS SECTION WE SHOULD FIRST TRY TO FIND DEADLOCKS!
 		# There are three papers:
@@ -273,15 +574,16 @@ class Sokoban(Environment):
 		deadlock = False
 		# Check for situations where box cannot be moved any more to any of the possible end positions.
 		# First we start with corner position.
-		if newBoxPos is not None and newBoxPos not in self.endPosSet and self._in_corner(newBoxPos):
+		level = self.level
+		if newBoxPos is not None and newBoxPos not in level.goals and newBoxPos in level.corners:
 			deadlock = True
 
 		# How many boxes are in end position and on edge of environment?
-		boxOnEdgeCount = sum(self._on_edge(loc) for loc in boxList)
+		boxOnEdgeCount = sum(loc in level.edges for loc in boxList)
 
 		# Check if the number of boxes on edges
 		# exceeds number of ends on edge
-		if boxOnEdgeCount > sum(self._on_edge(loc) for loc in self.endPosSet):
+		if boxOnEdgeCount > level.goalsOnEdge:
 			# When a box is on the edge it cannot be moved to the center
 			# and that is why the game is over
 			# TODO: Jernej, check if this is a fact
@@ -300,19 +602,18 @@ class Sokoban(Environment):
 		actions = []
 
 		# Possible actions (0, +1), (0, -1), etc.
+		steps = self.level.steps
 		for diff in self.possibleActions:
-			newPos = self._add(agentPos, diff)
-			if not self._in_borders(newPos) or newPos in self.stonePosSet:
+			step = steps[diff]
+			newPos = step.get(agentPos)
+			if newPos is None: # stone or border
 				continue
 			if newPos in boxPosSet: # we are moving a box
-				newBoxPos = self._add(newPos, diff)
+				newBoxPos = step.get(newPos)
 
-				# Remove position of the moved box. The position matches the new position of agent.
-				otherBoxes = boxPosSet - {newPos, } # get other boxes
-				if newBoxPos in otherBoxes:
-					# you cannot move two boxes in same time
-					continue
-				if not self._in_borders(newBoxPos) or newBoxPos in self.stonePosSet:
+				# The moved box cannot go into a stone, a border or
+				# another box (you cannot move two boxes in same time).
+				if newBoxPos is None or newBoxPos in boxPosSet:
 					continue
 			# everything is OK
 			actions.append(diff) # TODO: check if absolute actions are better
@@ -320,6 +621,391 @@ class Sokoban(Environment):
 		return actions
 
 
+class PushSokoban(Sokoban):
+	"""
+	Sokoban where actions are box pushes instead of single steps.
+
+	An action is (boxPos, diff): the agent walks along a shortest
+	path over free squares to the square next to the box and pushes
+	it one square in direction diff. All the walking is one action,
+	so states where the agent only walks around between pushes are
+	never seen by the agent. For every step walked REWARD_DEFAULT is
+	charged, the push itself is rewarded as in Sokoban.do. A state
+	where no box can be pushed is a deadlock.
+
+	With canonical=True the agent position in states is replaced by
+	the smallest square of the region the agent can walk to, so all
+	states with the same boxes and the agent anywhere in the same
+	region are one state. These states are only equivalent if walking
+	costs nothing, so then only pushes are charged, rewards (and energies
+	of solve) are not the ones of Sokoban. The state does not tell where
+	the agent really stands (the starting square, later the square the
+	last pushed box was on), pass it to path or use expand to get moves
+	which can be executed in Sokoban.
+	"""
+	def __init__(self, *args, **kwargs):
+		self.canonical = kwargs.pop('canonical', False)
+		Sokoban.__init__(self, *args, **kwargs)
+
+		# Box configuration => {square: canonical square of its region}.
+		self.regionCache = {}
+
+	def _canonical(self, state):
+		"""
+		State with the agent moved to the canonical square of its region.
+		"""
+		if not self.canonical:
+			return state
+		boxes = state[1:]
+		squares = self.regionCache.get(boxes)
+		if squares is None:
+			if len(self.regionCache) >= REGION_CACHE_SIZE:
+				self.regionCache.clear()
+			squares = self.regionCache[boxes] = {}
+		if state[0] not in squares:
+			region = self._walk(state[0], set(boxes))
+			square = min(region)
+			for loc in region:
+				squares[loc] = square
+		return (squares[state[0]], ) + boxes
+
+	def getStartingState(self):
+		return self._canonical(self.startPos)
+
+	def _walk(self, agentPos, boxPosSet):
+		"""
+		Breadth first search over free squares (no stones, no boxes)
+		from agentPos. Returns {square: (distance, previous square, diff)}.
+		"""
+		steps = self.level.steps
+		reach = {agentPos: (0, None, None)}
+		queue = deque([agentPos])
+		while queue:
+			loc = queue.popleft()
+			dist = reach[loc][0]
+			for diff in self.possibleActions:
+				newLoc = steps[diff].get(loc)
+				if newLoc is not None and newLoc not in reach and newLoc not in boxPosSet:
+					reach[newLoc] = (dist + 1, loc, diff)
+					queue.append(newLoc)
+		return reach
+
+	def getActions(self, state):
+		boxPosSet = set(state[1:])
+		reach = self._walk(state[0], boxPosSet)
+		actions = []
+		steps = self.level.steps
+		for box in state[1:]:
+			for diff in self.possibleActions:
+				newBoxPos = steps[diff].get(box)
+				if newBoxPos is not None and newBoxPos not in boxPosSet and \
+				   self._add(box, (-diff[0], -diff[1])) in reach:
+					actions.append((box, diff))
+		return actions
+
+	def path(self, state, action, agentPos=None):
+		"""
+		Single step actions (as in Sokoban) which execute push action in state.
+		@param agentPos: Square the agent really stands on, in the region
+			of state[0] (needed with canonical=True, see expand), state[0] by default.
+		"""
+		box, diff = action
+		reach = self._walk(state[0] if agentPos is None else agentPos, set(state[1:]))
+		loc = self._add(box, (-diff[0], -diff[1]))
+		steps = [diff]
+		while reach[loc][1] is not None:
+			steps.append(reach[loc][2])
+			loc = reach[loc][1]
+		return steps[::-1]
+
+	def expand(self, actions):
+		"""
+		Single step actions (as in Sokoban) which execute push actions
+		from the starting state. The agent really stands on the starting
+		square and after every push on the square the box was pushed from,
+		so the moves are the same in canonical states.
+		"""
+		state, agentPos, moves = self.getStartingState(), self.startPos[0], []
+		for action in actions:
+			moves += self.path(state, action, agentPos)
+			state, agentPos = self.do(state, action)[0], action[0]
+		return moves
+
+	def do(self, state, action):
+		box, diff = action
+		standPos = self._add(box, (-diff[0], -diff[1]))
+		newState, reward, isTerminalState = Sokoban.do(self, (standPos, ) + state[1:], diff)
+		if not isTerminalState and not self.getActions(newState):
+			# No box can be pushed any more.
+			reward, isTerminalState = REWARD_DEADLOCK, True
+		if not self.canonical:
+			# Walking to the box, canonical states do not know where the agent starts from.
+			reward += REWARD_DEFAULT * self._walk(state[0], set(state[1:]))[standPos][0]
+		return self._canonical(newState), reward, isTerminalState
+
+	def printPolicy(self, policy):
+		# Show direction of the push in every state.
+		Sokoban.printPolicy(self, dict((state, act[1]) for state, act in policy.iteritems()))
+
+
+class PackedSokoban(Sokoban):
+	"""
+	Sokoban with states packed into single integers.
+
+	Floor cells (cells inside borders that are not stones) are
+	numbered once, in the order of columns then rows. A state is
+	agentCell | boxMask << shift, where bit i of boxMask tells if
+	there is a box on floor cell i. Neighbors, goals, dead squares,
+	corners and edges are precompiled, so do and getActions only do table
+	lookups and bit operations, and states hash as ints.
+
+	Actions are the same as in Sokoban. Use decodeState/encodeState
+	to convert states to the tuple notation (printState and
+	printPolicy do that themselves).
+	"""
+	def __init__(self, *args, **kwargs):
+		Sokoban.__init__(self, *args, **kwargs)
+
+		self.cells = self.level.floor
+		self.cellIds = dict((pos, cell) for cell, pos in enumerate(self.cells))
+		self.shift = len(self.cells).bit_length()
+		self.agentMask = (1 << self.shift) - 1
+
+		# Neighbor floor cell of every cell for every action, -1 for stones and borders.
+		self.neighbors = [[self.cellIds[self.level.steps[diff][pos]] if pos in self.level.steps[diff] else -1
+						   for pos in self.cells]
+						  for diff in self.possibleActions]
+		self.actionIds = dict((diff, d) for d, diff in enumerate(self.possibleActions))
+
+		self.goalMask = self._mask(self.endPosSet)
+		self.deadMask = self._mask(self.deadSquares)
+		self.cornerMask = self._mask(self.level.corners)
+		self.edgeMask = self._mask(self.level.edges)
+		self.goalsOnEdge = self.level.goalsOnEdge
+
+	def _mask(self, positions):
+		mask = 0
+		for pos in positions:
+			if pos in self.cellIds:
+				mask |= 1 << self.cellIds[pos]
+		return mask
+
+	def encodeState(self, state):
+		return self.cellIds[state[0]] | self._mask(state[1:]) << self.shift
+
+	def decodeState(self, state):
+		boxes = state >> self.shift
+		return (self.cells[state & self.agentMask], ) + \
+			   tuple(pos for cell, pos in enumerate(self.cells) if boxes >> cell & 1)
+
+	def printState(self, state):
+		Sokoban.printState(self, self.decodeState(state))
+
+	def _pushesValue(self, state):
+		return Sokoban._pushesValue(self, self.decodeState(state))
+
+	def printPolicy(self, policy):
+		Sokoban.printPolicy(self, dict((self.decodeState(state), act) for state, act in policy.iteritems()))
+
+	def getStartingState(self):
+		return self.encodeState(self.startPos)
+
+	def do(self, state, action):
+		# Select appropriate action given notation.
+		if action in self.possibleActionsDict:
+			action = self.possibleActionsDict[action]
+		neighbors = self.neighbors[self.actionIds[action]]
+
+		agent = state & self.agentMask
+		boxes = state >> self.shift
+		newPos = neighbors[agent]
+		reward = REWARD_DEFAULT
+		isTerminalState = False
+		deadlock = False
+
+		# Actions which are not in getActions (into a stone or the border,
+		# or pushing a box into one or into another box) do not move anything.
+		if newPos < 0:
+			return state, reward, isTerminalState
+
+		if boxes >> newPos & 1:
+			newBoxPos = neighbors[newPos]
+			if newBoxPos < 0 or boxes >> newBoxPos & 1:
+				return state, reward, isTerminalState
+			boxes ^= 1 << newPos | 1 << newBoxPos
+			reward = REWARD_MOVE_BOX
+			if self.goalMask >> newBoxPos & 1:
+				reward = REWARD_BOX_ON_END
+			elif 'simple' in self.deadlocks and self.cornerMask >> newBoxPos & 1:
+				deadlock = True
+			if 'dead_squares' in self.deadlocks and self.deadMask >> newBoxPos & 1:
+				deadlock = True
+			elif 'freeze' in self.deadlocks or 'matching' in self.deadlocks:
+				# Cached per box mask, positions are decoded only for new configurations.
+				deadlock = self.deadlockCache.get(boxes)
+				if deadlock is None:
+					positions = tuple(pos for cell, pos in enumerate(self.cells) if boxes >> cell & 1)
+					deadlock = self._remember_deadlock(boxes, self._config_deadlock(positions))
+
+		# The same edge rule as in Sokoban._simple_deadlock.
+		if 'simple' in self.deadlocks and bin(boxes & self.edgeMask).count("1") > self.goalsOnEdge:
+			deadlock = True
+
+		if deadlock:
+			reward = REWARD_DEADLOCK
+			isTerminalState = True
+
+		if boxes & self.goalMask == self.goalMask:
+			reward = REWARD_SOLVED
+			isTerminalState = True
+
+		return newPos | boxes << self.shift, reward, isTerminalState
+
+	def getActions(self, state):
+		agent = state & self.agentMask
+		boxes = state >> self.shift
+		actions = []
+		for diff, neighbors in zip(self.possibleActions, self.neighbors):
+			newPos = neighbors[agent]
+			if newPos < 0:
+				continue
+			if boxes >> newPos & 1:
+				newBoxPos = neighbors[newPos]
+				if newBoxPos < 0 or boxes >> newBoxPos & 1:
+					continue
+			actions.append(diff)
+		return actions
+
+
+class VectorSokoban():
+	"""
+	Batch of B configurations of one Sokoban level, stepped together.
+
+	The level is compiled once into flat NumPy tables over cells of
+	the grid padded with one wall cell on every side (so the borders
+	are walls too): walls, goals, dead squares, corners and edges. Configurations
+	are kept as arrays, agent[b] is the cell of the agent and
+	boxes[b, c] tells if there is a box on cell c.
+
+	Actions are indices into env.possibleActions. step gives the same
+	rewards and terminal flags as Sokoban.do would for every member
+	of the batch; an action which is not possible leaves the member
+	as it is (with REWARD_DEFAULT).
+	"""
+	def __init__(self, env, batchSize=1):
+		if np is None:
+			raise ImportError("VectorSokoban requires numpy")
+		self.env = env
+		self.batchSize = batchSize
+		self.width = env.size[0] + 2
+		self.numCells = self.width * (env.size[1] + 2)
+
+		self.wall = np.ones(self.numCells, dtype=np.bool_)
+		self.goal = np.zeros(self.numCells, dtype=np.bool_)
+		self.dead = np.zeros(self.numCells, dtype=np.bool_)
+		self.corner = np.zeros(self.numCells, dtype=np.bool_)
+		self.edge = np.zeros(self.numCells, dtype=np.bool_)
+		for i in range(env.size[0]):
+			for j in range(env.size[1]):
+				pos = (i, j)
+				cell = self.cell(pos)
+				self.wall[cell] = pos in env.stonePosSet
+				self.goal[cell] = pos in env.endPosSet
+				self.dead[cell] = pos in env.deadSquares
+				self.corner[cell] = pos in env.level.corners
+				self.edge[cell] = pos in env.level.edges
+		self.numGoals = len(env.endPosSet)
+		self.goalsOnEdge = env.level.goalsOnEdge
+
+		# Cell offsets of the actions, in the order of env.possibleActions.
+		self.deltas = np.array([dx + dy * self.width for dx, dy in env.possibleActions])
+
+		self.agent = np.zeros(batchSize, dtype=np.int64)
+		self.boxes = np.zeros((batchSize, self.numCells), dtype=np.bool_)
+		self.reset()
+
+	def cell(self, pos):
+		return (pos[1] + 1) * self.width + pos[0] + 1
+
+	def pos(self, cell):
+		return (cell % self.width - 1, cell // self.width - 1)
+
+	def reset(self, states=None, which=None):
+		"""
+		Set members which (default all) to states (default starting state).
+		"""
+		which = np.arange(self.batchSize) if which is None else np.asarray(which)
+		if states is None:
+			states = [self.env.startPos] * len(which)
+		for b, state in zip(which, states):
+			self.agent[b] = self.cell(state[0])
+			self.boxes[b] = False
+			self.boxes[b, [self.cell(box) for box in state[1:]]] = True
+
+	def state(self, b):
+		"""
+		State of member b in the notation of Sokoban.
+		"""
+		boxes = sorted(self.pos(cell) for cell in np.flatnonzero(self.boxes[b]))
+		return (self.pos(self.agent[b]), ) + tuple(boxes)
+
+	def states(self):
+		return [self.state(b) for b in range(self.batchSize)]
+
+	def getActions(self):
+		"""
+		Legal action mask of shape (B, number of actions), the same
+		actions as Sokoban.getActions returns for every member.
+		"""
+		batch = np.arange(self.batchSize)[:, None]
+		target = self.agent[:, None] + self.deltas[None, :]
+		beyond = np.clip(target + self.deltas[None, :], 0, self.numCells - 1)
+		free = ~self.wall[target]
+		pushable = ~self.wall[beyond] & ~self.boxes[batch, beyond]
+		return free & (~self.boxes[batch, target] | pushable)
+
+	def step(self, actions):
+		"""
+		Execute actions[b] for every member b.
+
+		Returns (agent, boxes, rewards, terminal, masks), where masks
+		are the legal actions in the new configurations. agent and boxes
+		are copies, the next step does not change them.
+		"""
+		actions = np.asarray(actions)
+		batch = np.arange(self.batchSize)
+		legal = self.getActions()[batch, actions]
+		delta = self.deltas[actions]
+		target = self.agent + delta
+		beyond = np.clip(target + delta, 0, self.numCells - 1)
+
+		# Move boxes and the agent.
+		push = legal & self.boxes[batch, target]
+		self.boxes[batch[push], target[push]] = False
+		self.boxes[batch[push], beyond[push]] = True
+		self.agent = np.where(legal, target, self.agent)
+
+		rewards = np.full(self.batchSize, REWARD_DEFAULT, dtype=np.float64)
+		rewards[push] = REWARD_MOVE_BOX
+		rewards[push & self.goal[beyond]] = REWARD_BOX_ON_END
+
+		# The same deadlock rules as Sokoban._deadlock_detection.
+		deadlock = np.zeros(self.batchSize, dtype=np.bool_)
+		if 'dead_squares' in self.env.deadlocks:
+			deadlock |= push & self.dead[beyond]
+		if 'simple' in self.env.deadlocks:
+			deadlock |= push & ~self.goal[beyond] & self.corner[beyond]
+			deadlock |= (self.boxes & self.edge).sum(axis=1) > self.goalsOnEdge
+		if 'freeze' in self.env.deadlocks or 'matching' in self.env.deadlocks:
+			for b in np.flatnonzero(push & ~deadlock):
+				deadlock[b] = self.env._deadlock_detection(self.pos(beyond[b]), self.state(b)[1:])
+		solved = (self.boxes & self.goal).sum(axis=1) == self.numGoals
+		rewards[deadlock] = REWARD_DEADLOCK
+		rewards[solved] = REWARD_SOLVED
+
+		return self.agent, self.boxes.copy(), rewards, deadlock | solved, self.getActions()
+
+
 simple1 = Sokoban("simple1", (5,5), 
 				  agentPos=(1,1),
 				  boxPosList=[(1,2)],
@@ -26,9 +26,11 @@ def plot_agents(agents, field,
 	if not func:
 		func = lambda x, other: x
 	
+	# Values of agents can be agents or just their history lists.
 	for name, agnt in agents.iteritems():
-		x = np.arange(1, len(agnt.history)+1, 1)
-		y = np.array([func(h[field], h) for h in agnt.history])
+		history = getattr(agnt, 'history', agnt)
+		x = np.arange(1, len(history)+1, 1)
+		y = np.array([func(h[field], h) for h in history])
 
 		plt.plot(x,y, label=name, color=COLORS[i % len(COLORS)])
 		i += 1
@@ -0,0 +1,330 @@
+import array
+from itertools import compress, izip
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+
+class StateColumn(array.array):
+	"""
+	Values of one field of all states (i.e. utilities) in a flat
+	array.array indexed by state ID, so a value takes a machine word
+	instead of an object. Values equal to missing are not known yet.
+
+	It supports the operations the algorithms in agents.py use on
+	their dict tables (get, in, setdefault, iteration, ...). [] and
+	[]= are those of array.array, so a missing value is returned
+	instead of raising KeyError. len and iteration check all states
+	at once (with numpy if it is available).
+	"""
+	__slots__ = ()
+	format = None
+	missing = None
+
+	def __new__(cls, size=0):
+		column = array.array.__new__(cls, cls.format)
+		column.grow(size)
+		return column
+
+	def __init__(self, size=0):
+		pass
+
+	def grow(self, size):
+		"""
+		Add missing values up to size states.
+		"""
+		size -= array.array.__len__(self)
+		if size > 0:
+			self.extend(array.array(self.format, [self.missing]) * size)
+
+	def known(self):
+		"""
+		Which values are known, one bool per state ID.
+		"""
+		if np is not None and array.array.__len__(self):
+			return self._known(np.frombuffer(self, self.format))
+		return [self._known(value) for value in array.array.__iter__(self)]
+
+	def clear(self):
+		array.array.__delitem__(self, slice(None))
+
+	def __delitem__(self, sid):
+		self[sid] = self.missing
+
+	def __iter__(self):
+		return self.iterkeys()
+
+	def __len__(self):
+		return int(np.count_nonzero(self.known())) if np is not None else sum(self.known())
+
+	def __nonzero__(self):
+		return bool(np.any(self.known())) if np is not None else any(self.known())
+
+	def update(self, items):
+		for sid, value in (items.iteritems() if hasattr(items, 'iteritems') else items):
+			self[sid] = value
+
+	def iteritems(self):
+		return compress(enumerate(array.array.__iter__(self)), self.known())
+
+	def iterkeys(self):
+		return compress(xrange(array.array.__len__(self)), self.known())
+
+	def itervalues(self):
+		return compress(array.array.__iter__(self), self.known())
+
+	def items(self):
+		return list(self.iteritems())
+
+	def keys(self):
+		return list(self.iterkeys())
+
+	def values(self):
+		return list(self.itervalues())
+
+
+class FloatColumn(StateColumn):
+	"""
+	StateColumn of floats (rewards, utilities), NaN is missing.
+	"""
+	__slots__ = ()
+	format = 'd'
+	missing = float('nan')
+
+	@staticmethod
+	def _known(value):
+		return value == value
+
+	def __contains__(self, sid):
+		value = self[sid]
+		return value == value
+
+	def get(self, sid, default=None):
+		value = self[sid]
+		return value if value == value else default
+
+	def setdefault(self, sid, default=None):
+		value = self[sid]
+		if value == value:
+			return value
+		self[sid] = default
+		return default
+
+
+class IntColumn(StateColumn):
+	"""
+	StateColumn of non negative integers (visit counts), -1 is missing.
+	"""
+	__slots__ = ()
+	format = 'i'
+	missing = -1
+
+	@staticmethod
+	def _known(value):
+		return value >= 0
+
+	def __contains__(self, sid):
+		return self[sid] >= 0
+
+	def get(self, sid, default=None):
+		value = self[sid]
+		return value if value >= 0 else default
+
+	def setdefault(self, sid, default=None):
+		value = self[sid]
+		if value >= 0:
+			return value
+		self[sid] = default
+		return default
+
+
+class CodeColumn(IntColumn):
+	"""
+	IntColumn of action codes (policy), None is stored as missing.
+	"""
+	__slots__ = ()
+
+	def __setitem__(self, sid, code):
+		IntColumn.__setitem__(self, sid, -1 if code is None else code)
+
+
+class DecodedPolicy(object):
+	"""
+	Policy keyed by IDs and codes of interner seen as a policy keyed
+	by the states and actions of its environment (only get), so
+	Agent.solve can run on the environment itself and the states
+	it visits are not interned.
+	"""
+	__slots__ = ('interner', 'policy')
+
+	def __init__(self, interner, policy):
+		self.interner = interner
+		self.policy = policy
+
+	def get(self, state, default=None):
+		interner = self.interner
+		sid = interner.stateIds.get(state)
+		if sid is None:
+			sid = interner.find(state)
+			if sid is None:
+				return default
+		try:
+			code = self.policy[sid]
+		except KeyError:
+			return default
+		return interner.actions[code] if code >= 0 else default
+
+
+class StateInterner():
+	"""
+	Environment wrapper which shows states as dense integer IDs and
+	actions as small integer codes, as proposed in templateRL.py.
+	The state tuples are hashed once, when the wrapped environment
+	returns them, and all the agent tables are then keyed by IDs.
+
+	Per state values are kept in columns (arrays indexed by state ID),
+	the tables of the agent are these columns (see table), the
+	transition table is a dict keyed by IDs (see stateDict).
+	Subclasses (storage.DiskStateInterner) may keep the other tables
+	of the agent elsewhere as well, see modelTable, stateList, stateSet.
+	"""
+	def __init__(self, env):
+		self.bind(env)
+		self.states = []
+		self.stateIds = {}
+		self.tables = {
+			'n': IntColumn(),
+			'reward': FloatColumn(),
+			'utility': FloatColumn(),
+			'action': CodeColumn(),
+		}
+		self.stateActions = []
+		self.actionSets = {}
+		self.actions = []
+		self.actionCodes = {}
+
+		# Codes of known actions follow their order, so max() over
+		# (estimate, action) pairs breaks ties the same way as without IDs.
+		for ac in sorted(getattr(env, 'possibleActions', None) or getattr(env, 'possible_actions', None) or ()):
+			self.actionCode(ac)
+
+	def __len__(self):
+		return len(self.states)
+
+	def bind(self, env):
+		"""
+		Wrap env, the known states and actions are kept, so an agent
+		can continue learning with the same IDs (i.e. after a checkpoint).
+		"""
+		self.env = env
+		self.name = getattr(env, 'name', None)
+		self.deterministic = getattr(env, 'deterministic', False)
+		if hasattr(env, 'optimisticValue'):
+			self.optimisticValue = lambda sid, code=None: env.optimisticValue(self.states[sid], self.action(code))
+		elif 'optimisticValue' in self.__dict__:
+			del self.optimisticValue
+
+	def restore(self, states, actions):
+		"""
+		Replace the known states and actions by the given ones (their
+		IDs and codes are their indices), every value is missing. The
+		states and the tables are changed in place, so the agent keeps
+		using them.
+		"""
+		self.states[:] = states
+		self.stateIds = dict(izip(self.states, xrange(len(self.states))))
+		for column in self.tables.itervalues():
+			column.clear()
+			column.grow(len(self.states))
+		self.stateActions[:] = [None] * len(self.states)
+		self.actions = list(actions)
+		self.actionCodes = dict(izip(self.actions, xrange(len(self.actions))))
+
+	def stateId(self, state):
+		sid = self.stateIds.get(state)
+		if sid is None:
+			sid = self.stateIds[state] = len(self.states)
+			self.states.append(state)
+			for column in self.tables.itervalues():
+				column.append(column.missing)
+			self.stateActions.append(None)
+		return sid
+
+	def find(self, state):
+		"""
+		ID of state, None if it was not interned yet.
+		"""
+		return self.stateIds.get(state)
+
+	def actionCode(self, action):
+		code = self.actionCodes.get(action)
+		if code is None:
+			code = self.actionCodes[action] = len(self.actions)
+			self.actions.append(action)
+		return code
+
+	def state(self, sid):
+		return self.states[sid]
+
+	def action(self, code):
+		return None if code is None else self.actions[code]
+
+	def table(self, field):
+		return self.tables[field]
+
+	def stateDict(self):
+		"""
+		Empty transition table keyed by the IDs of this interner. A dict
+		of dense IDs iterates them in increasing order, so the planners
+		sweep the states in the order they were interned, not in the
+		order of a dict keyed by the states themselves.
+		"""
+		return {}
+
+	def modelTable(self, name):
+		"""
+		Empty nested table (probabilities, successors, predecessors) keyed by IDs.
+		"""
+		return {}
+
+	def stateList(self):
+		"""
+		Empty list of IDs (states in order of insertion).
+		"""
+		return []
+
+	def stateSet(self):
+		"""
+		Empty set of IDs (terminal states).
+		"""
+		return set()
+
+	def close(self):
+		"""
+		Release the resources of the interner, nothing to do in memory.
+		"""
+		pass
+
+	def decodePolicy(self, policy):
+		"""
+		Policy keyed by the states and actions of the wrapped environment.
+		"""
+		return dict((self.states[sid], self.actions[code]) for sid, code in policy.iteritems())
+
+	def getStartingState(self):
+		return self.stateId(self.env.getStartingState())
+
+	def do(self, state, action):
+		newState, reward, isTerminal = self.env.do(self.states[state], self.actions[action])
+		return self.stateId(newState), reward, isTerminal
+
+	def getActions(self, state):
+		# Possible actions depend only on the state, so they are kept per state
+		# ID, states with the same actions share one tuple of their codes.
+		actions = self.stateActions[state]
+		if actions is None:
+			actions = tuple(self.actionCode(ac) for ac in self.env.getActions(self.states[state]))
+			actions = self.stateActions[state] = self.actionSets.setdefault(actions, actions)
+		return list(actions)
@@ -0,0 +1,338 @@
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+
+class GrowableArray():
+	"""
+	One dimensional NumPy array which grows (doubles) when
+	elements are appended. Use view() to get the used part.
+	"""
+	def __init__(self, dtype, fill=0):
+		self.data = np.empty(16, dtype=dtype)
+		self.data.fill(fill)
+		self.fill = fill
+		self.size = 0
+
+	def __len__(self):
+		return self.size
+
+	def append(self, value):
+		if self.size == len(self.data):
+			data = np.empty(2 * len(self.data), dtype=self.data.dtype)
+			data[:self.size] = self.data
+			data[self.size:] = self.fill
+			self.data = data
+		self.data[self.size] = value
+		self.size += 1
+		return self.size - 1
+
+	def view(self):
+		return self.data[:self.size]
+
+
+class SparseModel():
+	"""
+	Learned model of the environment kept in flat arrays instead
+	of nested dicts. Every (state, action) pair is a row, every
+	observed outcome an entry (row, successor column, count), the
+	same data as transs[state][action][newState] in agents.py.
+
+	Rows and entries are only appended, so the arrays grow together
+	with the model. A sweep is done in place (Gauss-Seidel) in a given
+	order of states, as in _policy_iteration, but states which do not
+	read each other's new utilities are updated together (see schedule),
+	each group with a sparse matrix-vector product (np.bincount over
+	the entries) followed by a segmented max over the rows of every state.
+	"""
+	def __init__(self):
+		if np is None:
+			raise ImportError("SparseModel requires numpy")
+
+		# States and actions are numbered in order of appearance.
+		self.states = []
+		self.stateIds = {}
+		self.actions = []
+		self.actionIds = {}
+
+		# Per state: utility, reward, policy row.
+		self.utils = GrowableArray(np.float64)
+		self.rewards = GrowableArray(np.float64)
+		self.hasReward = GrowableArray(np.bool_, False)
+		self.policyRow = GrowableArray(np.int64, -1)
+
+		# Per (state, action) row: state, action and N_sa.
+		self.rowIds = {}
+		self.rowState = GrowableArray(np.int64)
+		self.rowAction = GrowableArray(np.int64)
+		self.rowTotal = GrowableArray(np.float64)
+
+		# Per entry: row, successor and N_s'_sa.
+		self.entryIds = {}
+		self.entryRow = GrowableArray(np.int64)
+		self.entryCol = GrowableArray(np.int64)
+		self.entryCount = GrowableArray(np.float64)
+
+		self._probs = None
+		self._ranks = None
+		self._schedule = None
+
+	def __len__(self):
+		return len(self.states)
+
+	def __getstate__(self):
+		# Probabilities, action ranks and the schedule are computed again when needed.
+		state = dict(self.__dict__)
+		state.update(_probs=None, _ranks=None, _schedule=None)
+		return state
+
+	def stateId(self, state):
+		sid = self.stateIds.get(state)
+		if sid is None:
+			sid = self.stateIds[state] = len(self.states)
+			self.states.append(state)
+			self.utils.append(0)
+			self.rewards.append(0)
+			self.hasReward.append(False)
+			self.policyRow.append(-1)
+		return sid
+
+	def rowId(self, state, action):
+		sid = self.stateId(state)
+		aid = self.actionIds.get(action)
+		if aid is None:
+			aid = self.actionIds[action] = len(self.actions)
+			self.actions.append(action)
+			self._ranks = None
+		row = self.rowIds.get((sid, aid))
+		if row is None:
+			row = self.rowIds[(sid, aid)] = self.rowState.append(sid)
+			self.rowAction.append(aid)
+			self.rowTotal.append(0)
+			self._schedule = None
+		return row
+
+	def add(self, state, action, newState, count=1):
+		"""
+		Count that executing action in state resulted in newState.
+		"""
+		row = self.rowId(state, action)
+		col = self.stateId(newState)
+		entry = self.entryIds.get((row, col))
+		if entry is None:
+			entry = self.entryIds[(row, col)] = self.entryRow.append(row)
+			self.entryCol.append(col)
+			self.entryCount.append(0)
+			self._schedule = None
+		self.entryCount.data[entry] += count
+		self.rowTotal.data[row] += count
+		self._probs = None
+
+	def addActions(self, state, actions):
+		for ac in actions:
+			self.rowId(state, ac)
+
+	def setReward(self, state, reward):
+		sid = self.stateId(state)
+		self.rewards.data[sid] = reward
+		self.hasReward.data[sid] = True
+
+	def load(self, transs, utils, rewards, policy):
+		"""
+		Fill the model from dict tables (as used by _policy_iteration).
+		"""
+		for state, acts in transs.iteritems():
+			for ac, freq in acts.iteritems():
+				self.rowId(state, ac)
+				for newState, count in freq.iteritems():
+					self.add(state, ac, newState, count)
+		for state, sid in self.stateIds.iteritems():
+			self.utils.data[sid] = utils.get(state, 0)
+			if state in rewards:
+				self.setReward(state, rewards[state])
+			if policy.get(state) is not None and (sid, self.actionIds.get(policy[state])) in self.rowIds:
+				self.policyRow.data[sid] = self.rowIds[(sid, self.actionIds[policy[state]])]
+
+	def probabilities(self):
+		"""
+		P(s'|s, a) of every entry.
+		"""
+		if self._probs is None:
+			self._probs = self.entryCount.view() / self.rowTotal.view()[self.entryRow.view()]
+		return self._probs
+
+	def expected(self, utils):
+		"""
+		Expected utility sum_s' P(s'|s, a) U(s') of every row.
+		"""
+		return np.bincount(self.entryRow.view(), weights=self.probabilities() * utils[self.entryCol.view()],
+						   minlength=len(self.rowState))
+
+	def schedule(self, sids):
+		"""
+		Groups of a Gauss-Seidel sweep over the states sids (in this
+		order). A state reads the new utility of every successor
+		before it in sids and the old one of every successor after it,
+		so it comes in a later group than the first ones and in the
+		same or an earlier group than the others. The groups are the
+		longest paths over these constraints, every group is updated
+		at once and the result is the same as state after state.
+
+		Returns a list of (states, rows grouped by state, group starts,
+		entries of the rows, row of every entry within rows).
+		"""
+		if self._schedule is not None and np.array_equal(self._schedule[0], sids):
+			return self._schedule[1]
+
+		pos = np.empty(len(self.states), np.int64)
+		pos.fill(-1)
+		pos[sids] = np.arange(len(sids))
+		entryRow = self.entryRow.view()
+		readers = self.rowState.view()[entryRow]
+		read = self.entryCol.view()
+		readerPos, readPos = pos[readers], pos[read]
+		swept = (readerPos >= 0) & (readPos >= 0)
+		earlier = swept & (readPos < readerPos)
+		later = swept & (readPos > readerPos)
+		earlierReaders, earlierRead = readers[earlier], read[earlier]
+		laterReaders, laterRead = readers[later], read[later]
+
+		level = np.zeros(len(self.states), np.int64)
+		while True:
+			newLevel = level.copy()
+			np.maximum.at(newLevel, earlierReaders, level[earlierRead] + 1)
+			np.maximum.at(newLevel, laterRead, level[laterReaders])
+			if np.array_equal(newLevel, level):
+				break
+			level = newLevel
+
+		groups = []
+		rowState = self.rowState.view()
+		rowLevel = np.where(pos[rowState] >= 0, level[rowState], -1)
+		entryLevel = rowLevel[entryRow]
+		local = np.empty(len(rowState), np.int64)
+		for lvl in range(int(level[sids].max()) + 1 if len(sids) else 0):
+			rows = np.flatnonzero(rowLevel == lvl)
+			rows = rows[np.argsort(rowState[rows], kind='mergesort')]
+			states = rowState[rows]
+			starts = np.flatnonzero(np.r_[True, states[1:] != states[:-1]])
+			entries = np.flatnonzero(entryLevel == lvl)
+			local[rows] = np.arange(len(rows))
+			groups.append((states[starts], rows, starts, entries, local[entryRow[entries]]))
+		self._schedule = np.array(sids), groups
+		return groups
+
+	def sweep(self, sids, th=1, R_plus=None, N_e=None):
+		"""
+		One utility update U(s) = R(s) + th * max_a f(Q(s, a), N_sa) of
+		the states sids, in place in this order (see schedule). The
+		expected utility of a row adds its outcomes in the order they
+		were observed. Returns the largest change.
+		"""
+		utils, rewards = self.utils.view(), self.rewards.view()
+		probs, entryCol, rowTotal = self.probabilities(), self.entryCol.view(), self.rowTotal.view()
+		residual = 0.
+		for states, rows, starts, entries, entryRows in self.schedule(sids):
+			q = np.bincount(entryRows, weights=probs[entries] * utils[entryCol[entries]], minlength=len(rows))
+			if R_plus is not None and N_e is not None:
+				q = np.where(rowTotal[rows] < N_e, R_plus, q)
+			newUtils = rewards[states] + th * np.maximum.reduceat(q, starts)
+			residual = max(residual, np.abs(newUtils - utils[states]).max())
+			utils[states] = newUtils
+		return float(residual)
+
+	def improve(self):
+		"""
+		Policy improvement step. The best row of every state is found
+		the same way as max() over (estimate, action) pairs, so ties are
+		broken by the greater action. The policy of a state changes only
+		if the best estimate is greater than the estimate of its policy.
+
+		Returns (states, rows) whose policy was changed.
+		"""
+		if not len(self.rowState):
+			return [], []
+		if self._ranks is None:
+			ranks = sorted(range(len(self.actions)), key=lambda aid: self.actions[aid])
+			self._ranks = np.argsort(ranks)
+		q = self.expected(self.utils.view())
+		rowState = self.rowState.view()
+		order = np.lexsort((self._ranks[self.rowAction.view()], q, rowState))
+		sortedStates = rowState[order]
+		bestRows = order[np.flatnonzero(np.r_[sortedStates[1:] != sortedStates[:-1], True])]
+		groupStates = rowState[bestRows]
+
+		policyRow = self.policyRow.view()
+		current = policyRow[groupStates]
+		currentQ = np.where(current >= 0, q[current], -np.inf)
+		changed = (current < 0) | (q[bestRows] > currentQ)
+		policyRow[groupStates[changed]] = bestRows[changed]
+		return groupStates[changed], bestRows[changed]
+
+	def store(self, utils, sids):
+		"""
+		Write utilities of the states sids (i.e. the ones updated by sweep) into utils dict.
+		"""
+		utils.update(zip([self.states[sid] for sid in sids], self.utils.view()[sids].tolist()))
+
+
+class QTable():
+	"""
+	Action values Q(s, a) of the TD algorithms in agents.py kept in
+	flat arrays. Every (state, action) pair gets a row the first time
+	its state is seen, stateRows lists ((action, row), ...) of every
+	state. Values and visit counts (N_sa) are array elements, so one
+	step only touches a constant number of them. rowStates and
+	rowActions give the pair of every row, tried lists the rows which
+	were visited at least once.
+	"""
+	def __init__(self, init=0.):
+		if np is None:
+			raise ImportError("QTable requires numpy")
+		self.init = init
+		self.stateRows = {}
+		self.values = GrowableArray(np.float64, init)
+		self.counts = GrowableArray(np.int64)
+		self.rowStates = []
+		self.rowActions = []
+		self.tried = []
+
+	def __len__(self):
+		return len(self.values)
+
+	def rows(self, state, actions=()):
+		"""
+		(action, row) pairs of state, rows of new states are added for actions.
+		"""
+		rows = self.stateRows.get(state)
+		if rows is None:
+			rows = self.stateRows[state] = tuple((ac, self._newRow(state, ac)) for ac in actions)
+		return rows
+
+	def _newRow(self, state, action):
+		self.rowStates.append(state)
+		self.rowActions.append(action)
+		self.counts.append(0)
+		return self.values.append(self.init)
+
+	def visit(self, row):
+		"""
+		Increment N_sa of row and return it.
+		"""
+		self.counts.data[row] += 1
+		if self.counts.data[row] == 1:
+			self.tried.append(row)
+		return self.counts.data[row]
+
+	def best(self, state):
+		"""
+		(Q, action, row) of the best action of state, ties are broken
+		by actions as max() over (estimate, action) pairs does.
+		"""
+		values = self.values.data
+		rows = self.stateRows.get(state)
+		if not rows:
+			return 0., None, None
+		value, ac, row = max((values[row], ac, row) for ac, row in rows)
+		return float(value), ac, row
@@ -0,0 +1,49 @@
+import multiprocessing
+import random
+import agents as a
+
+
+def _run(job):
+	"""
+	Learn and solve one environment in a worker process.
+
+	The worker seeds its own random generator, so every job gives
+	the same result no matter which process runs it or when.
+	"""
+	key, env, alg, numOfTrials, params, seed = job
+	random.seed(seed)
+	agent = a.Agent()
+	agent.learn(env, alg=alg, numOfTrials=numOfTrials, **params)
+	result = agent.solve(env, agent.getPolicy())
+	return key, result, agent.history
+
+
+def run(jobs, processes=None, seed=0):
+	"""
+	Run independent learning jobs on a pool of processes and yield
+	(key, (actions, energy), history) for every job as soon as it
+	is finished, so results come back in order of completion.
+
+	Job i gets random seed seed + i. Environments, algorithms and
+	parameters are sent to the workers, so they must be picklable
+	(module level functions, no lambdas).
+
+	@param jobs: Iterable of (key, env, alg, numOfTrials, params).
+	@param processes: Number of worker processes (default is number of CPUs),
+		with 1 the jobs are run in this process.
+	@param seed: Seed of the first job.
+	"""
+	jobs = [job + (seed + i, ) for i, job in enumerate(jobs)]
+	if processes == 1:
+		for job in jobs:
+			yield _run(job)
+		return
+
+	pool = multiprocessing.Pool(processes)
+	try:
+		for result in pool.imap_unordered(_run, jobs):
+			yield result
+		pool.close()
+	finally:
+		pool.terminate()
+		pool.join()
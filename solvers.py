@@ -0,0 +1,121 @@
+import heapq
+import itertools
+import environments as e
+
+
+def _matching_cost(costs):
+	"""
+	Minimal cost of assigning every box to a different goal, costs[i][j]
+	is the cost of box i on goal j (None if it can never get there).
+	Dynamic programming over subsets of used goals. Returns None if
+	there is no assignment.
+
+	A level with more boxes than goals is solved when every goal has
+	a box, so then every goal is assigned a different box instead.
+	"""
+	if costs and len(costs) > len(costs[0]):
+		costs = zip(*costs)
+	best = {0: 0}
+	for row in costs:
+		nextBest = {}
+		for used, cost in best.iteritems():
+			for j, c in enumerate(row):
+				if c is not None and not used >> j & 1:
+					key = used | 1 << j
+					if cost + c < nextBest.get(key, float('inf')):
+						nextBest[key] = cost + c
+		best = nextBest
+		if not best:
+			return None
+	return min(best.itervalues())
+
+
+def astar(env, deadlocks=('dead_squares', 'freeze'), maxNodes=None):
+	"""
+	Optimal (fewest moves) solution of a Sokoban level with A*.
+
+	The search runs on a PackedSokoban copy of the level, so states
+	are single integers and the transposition table (best number of
+	moves and parent of every reached state) is a dict keyed by them.
+	Successors which the deadlock detectors mark as deadlocks are
+	pruned (the detectors are sound, so no solution is lost). The
+	heuristic is the minimal cost matching of boxes to goals by push
+	distances without other boxes (Sokoban.pushDistances); every push is a move, so it never
+	overestimates and the first solution found is optimal.
+
+	@param env: Sokoban (states as in Sokoban, not PushSokoban or PackedSokoban).
+	@param deadlocks: Deadlock detectors used for pruning (see Sokoban).
+		They assume that every box has to reach a goal, so they are not
+		used on levels with more boxes than goals.
+	@param maxNodes: Stop after this many expanded states.
+	@return: (actions, energy) in the format of Agent.solve, or None if
+		there is no solution (or maxNodes was reached).
+	"""
+	start = env.startPos
+	if len(start) - 1 > len(env.endPosSet):
+		deadlocks = ()
+	packed = e.PackedSokoban(env.name, env.size,
+							 agentPos=start[0],
+							 boxPosList=list(start[1:]),
+							 endPosList=list(env.endPosSet),
+							 stonePosList=list(env.stonePosSet),
+							 deadlocks=deadlocks)
+	goals = sorted(packed.endPosSet)
+	distances = [packed.pushDistances[goal] for goal in goals]
+
+	# Heuristic of every box configuration, None for dead ones.
+	heuristics = {}
+
+	def _heuristic(state):
+		boxes = state >> packed.shift
+		if boxes not in heuristics:
+			positions = [pos for cell, pos in enumerate(packed.cells) if boxes >> cell & 1]
+			heuristics[boxes] = _matching_cost([[dist.get(pos) for dist in distances] for pos in positions])
+		return heuristics[boxes]
+
+	state = packed.getStartingState()
+	if _heuristic(state) is None:
+		return None
+
+	# Transposition table: state => (moves, parent state, action).
+	table = {state: (0, None, None)}
+	counter = itertools.count()
+	heap = [(_heuristic(state), 0, next(counter), state)]
+	nodes = 0
+	while heap:
+		f, g, tie, state = heapq.heappop(heap)
+		if g > table[state][0]:
+			continue
+		if state >> packed.shift & packed.goalMask == packed.goalMask:
+			# Solved states are only accepted when they are expanded, as A* requires.
+			actions = []
+			while table[state][1] is not None:
+				actions.append(table[state][2])
+				state = table[state][1]
+			actions.reverse()
+			return actions, _energy(env, actions)
+		nodes += 1
+		if maxNodes is not None and nodes > maxNodes:
+			return None
+		for action in packed.getActions(state):
+			newState, reward, isTerminal = packed.do(state, action)
+			if isTerminal and reward != e.REWARD_SOLVED:
+				continue
+			if newState in table and table[newState][0] <= g + 1:
+				continue
+			table[newState] = (g + 1, state, action)
+			h = _heuristic(newState)
+			if h is not None:
+				heapq.heappush(heap, (g + 1 + h, g + 1, next(counter), newState))
+	return None
+
+
+def _energy(env, actions):
+	"""
+	Sum of rewards of executing actions in env from the starting state.
+	"""
+	state, energy = env.getStartingState(), 0
+	for action in actions:
+		state, reward, isTerminal = env.do(state, action)
+		energy += reward
+	return energy
@@ -0,0 +1,816 @@
+import cPickle as pickle
+import cStringIO
+import hashlib
+import os
+import struct
+import zlib
+from collections import OrderedDict
+from itertools import izip
+
+import interning
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+
+# Default number of states (and their IDs) kept in memory by DiskStateInterner.
+HOT_STATES = 100000
+
+# Initial number of elements of the memory mapped arrays, they double when full.
+INITIAL_CAPACITY = 1 << 16
+
+# Number of elements read from a memory mapped array at once when iterating it.
+CHUNK = 1 << 16
+
+_HASH = struct.Struct('<q')
+
+# Default of lookups which tells a missing value from any stored one.
+_MISSING = object()
+
+
+def _dumps(state):
+	"""
+	Pickle of state without memo references, so equal states always
+	give equal pickles (and hashes), even if they share objects.
+	"""
+	f = cStringIO.StringIO()
+	pickler = pickle.Pickler(f, 2)
+	pickler.fast = 1
+	pickler.dump(state)
+	return f.getvalue()
+
+
+def _create(path):
+	"""
+	Remove file path if it exists, so a new file is made instead of
+	overwriting the one of another store which is still open.
+	"""
+	if os.path.exists(path):
+		os.remove(path)
+
+
+class MemmapColumn():
+	"""
+	One dimensional numpy.memmap array in file path which grows
+	(doubles) when an element past its end is needed, new elements
+	are set to fill. Use data for the elements, size for how many
+	of them are used. data is a plain ndarray view of the memmap,
+	its element access is much faster than the one of numpy.memmap.
+	"""
+	def __init__(self, path, dtype, fill=0, capacity=INITIAL_CAPACITY):
+		self.path = path
+		self.dtype = np.dtype(dtype)
+		self.fill = fill
+		self.size = 0
+		_create(path)
+		self._map(np.memmap(path, dtype=self.dtype, mode='w+', shape=(capacity, )))
+		self.data[:] = fill
+
+	def _map(self, memmap):
+		self.memmap = memmap
+		self.data = None if memmap is None else memmap.view(np.ndarray)
+
+	def __len__(self):
+		return self.size
+
+	def resize(self, size):
+		"""
+		Use size elements, the file is extended if needed.
+		"""
+		capacity = len(self.data)
+		if size > capacity:
+			newCapacity = max(2 * capacity, size)
+			self.memmap.flush()
+			self._map(None)
+			with open(self.path, 'r+b') as f:
+				f.truncate(newCapacity * self.dtype.itemsize)
+			self._map(np.memmap(self.path, dtype=self.dtype, mode='r+', shape=(newCapacity, )))
+			self.data[capacity:] = self.fill
+		self.size = max(self.size, size)
+
+	def view(self):
+		return self.data[:self.size]
+
+	def chunks(self):
+		"""
+		(first index, elements) of the used elements, CHUNK elements at a time.
+		"""
+		for first in xrange(0, self.size, CHUNK):
+			yield first, self.data[first:min(first + CHUNK, self.size)]
+
+	def clear(self):
+		"""
+		Use no elements, the used ones are set to fill again.
+		"""
+		self.data[:self.size] = self.fill
+		self.size = 0
+
+	def flush(self):
+		self.memmap.flush()
+
+	def close(self):
+		if self.memmap is not None:
+			self.memmap.flush()
+			self._map(None)
+
+
+class ColumnTable(object):
+	"""
+	Dict-like view of a MemmapColumn keyed by state ID, with the same
+	operations as interning.StateColumn. Elements equal to missing
+	(NaN for float columns) are not in the table. Elements are read
+	with item, as Python numbers.
+	"""
+	__slots__ = ('column', 'missing')
+
+	def __init__(self, column, missing):
+		self.column = column
+		self.missing = missing
+
+	def _known(self, values):
+		if self.missing != self.missing:
+			return ~np.isnan(values)
+		return values != self.missing
+
+	def __contains__(self, sid):
+		value = self.column.data.item(sid)
+		return value == value and value != self.missing
+
+	def __getitem__(self, sid):
+		value = self.column.data.item(sid)
+		if value != value or value == self.missing:
+			raise KeyError(sid)
+		return value
+
+	def __setitem__(self, sid, value):
+		self.column.data[sid] = self.missing if value is None else value
+
+	def __delitem__(self, sid):
+		self.column.data[sid] = self.missing
+
+	def __iter__(self):
+		return self.iterkeys()
+
+	def __len__(self):
+		return int(np.count_nonzero(self._known(self.column.view())))
+
+	def get(self, sid, default=None):
+		value = self.column.data.item(sid)
+		return default if value != value or value == self.missing else value
+
+	def setdefault(self, sid, default=None):
+		value = self.column.data.item(sid)
+		if value != value or value == self.missing:
+			self.column.data[sid] = default
+			return default
+		return value
+
+	def update(self, items):
+		for sid, value in (items.iteritems() if hasattr(items, 'iteritems') else items):
+			self[sid] = value
+
+	def iteritems(self):
+		values = self.column.view()
+		sids = np.flatnonzero(self._known(values))
+		return iter(zip(sids.tolist(), values[sids].tolist()))
+
+	def iterkeys(self):
+		return iter(np.flatnonzero(self._known(self.column.view())).tolist())
+
+	def itervalues(self):
+		values = self.column.view()
+		return iter(values[self._known(values)].tolist())
+
+	def items(self):
+		return list(self.iteritems())
+
+	def keys(self):
+		return list(self.iterkeys())
+
+	def values(self):
+		return list(self.itervalues())
+
+
+class _LRU(OrderedDict):
+	"""
+	OrderedDict which forgets the least recently stored entry when it has more than size entries.
+	"""
+	def __init__(self, size):
+		OrderedDict.__init__(self)
+		self.size = size
+
+	def store(self, key, value):
+		"""
+		Store value under key, returns the forgotten (key, value) or None.
+		"""
+		forgotten = None
+		if key in self:
+			del self[key]
+		elif len(self) >= self.size:
+			forgotten = self.popitem(last=False)
+		self[key] = value
+		return forgotten
+
+
+class ObjectTable(object):
+	"""
+	Dict-like table of picklable values keyed by state ID in files at
+	path, for the nested tables of the agent (transitions, probabilities,
+	successors, predecessors). Values are pickled into an append-only
+	file, with room to grow in place. Start, length, room and CRC-32 of
+	the pickle of every ID are MemmapColumns, start is -1 for missing
+	IDs and -2 for values which were not written yet.
+
+	Only hot recently stored values are kept in memory, a value is written
+	when it is forgotten (or on flush) and only if its pickle changed, so
+	it may be changed in place (transs[state][action][newState] += 1)
+	until another value is stored. IDs are iterated in increasing order.
+	"""
+	def __init__(self, path, hot=HOT_STATES):
+		if np is None:
+			raise ImportError("ObjectTable requires numpy")
+		_create(path + '.bin')
+		self.file = open(path + '.bin', 'w+b')
+		self.start = MemmapColumn(path + '.start.bin', np.int64, -1)
+		self.length = MemmapColumn(path + '.length.bin', np.int64)
+		self.room = MemmapColumn(path + '.room.bin', np.int64)
+		self.crc = MemmapColumn(path + '.crc.bin', np.int64)
+		self.cache = _LRU(hot)
+		self.count = 0
+		self.end = 0
+
+	def _start(self, sid):
+		return self.start.data.item(sid) if sid < self.start.size else -1
+
+	def _read(self, sid):
+		self.file.seek(self.start.data[sid])
+		return pickle.loads(self.file.read(self.length.data[sid]))
+
+	def _write(self, sid, value):
+		data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+		crc = zlib.crc32(data) & 0xffffffff
+		start = int(self.start.data[sid])
+		if start >= 0 and self.length.data[sid] == len(data) and self.crc.data[sid] == crc:
+			return
+		if start < 0 or len(data) > self.room.data[sid]:
+			# Moved to the end of the file, with room for twice the pickle.
+			start = self.start.data[sid] = self.end
+			self.room.data[sid] = 2 * len(data)
+			self.end += 2 * len(data)
+		self.file.seek(start)
+		self.file.write(data)
+		self.length.data[sid] = len(data)
+		self.crc.data[sid] = crc
+
+	def _hold(self, sid, value):
+		forgotten = self.cache.store(sid, value)
+		if forgotten is not None:
+			self._write(*forgotten)
+
+	def __len__(self):
+		return self.count
+
+	def __contains__(self, sid):
+		return self._start(sid) != -1
+
+	def _load(self, sid):
+		if self._start(sid) < 0:
+			raise KeyError(sid)
+		value = self._read(sid)
+		self._hold(sid, value)
+		return value
+
+	def __getitem__(self, sid):
+		value = self.cache.get(sid, _MISSING)
+		return self._load(sid) if value is _MISSING else value
+
+	def __setitem__(self, sid, value):
+		if self._start(sid) == -1:
+			if sid >= len(self.start):
+				for column in (self.start, self.length, self.room, self.crc):
+					column.resize(sid + 1)
+			self.start.data[sid] = -2
+			self.count += 1
+		self._hold(sid, value)
+
+	def __delitem__(self, sid):
+		if self._start(sid) == -1:
+			raise KeyError(sid)
+		self.cache.pop(sid, None)
+		self.start.data[sid] = -1
+		self.count -= 1
+
+	def __iter__(self):
+		return self.iterkeys()
+
+	def get(self, sid, default=None):
+		value = self.cache.get(sid, _MISSING)
+		if value is _MISSING:
+			return self._load(sid) if self._start(sid) >= 0 else default
+		return value
+
+	def setdefault(self, sid, default=None):
+		value = self.get(sid, _MISSING)
+		if value is _MISSING:
+			self[sid] = value = default
+		return value
+
+	def update(self, items):
+		for sid, value in (items.iteritems() if hasattr(items, 'iteritems') else items):
+			self[sid] = value
+
+	def iterkeys(self):
+		for first, starts in self.start.chunks():
+			for sid in np.flatnonzero(starts != -1).tolist():
+				yield first + sid
+
+	def iteritems(self):
+		# Values are read without keeping them in memory.
+		for sid in self.iterkeys():
+			value = self.cache.get(sid, _MISSING)
+			yield sid, self._read(sid) if value is _MISSING else value
+
+	def itervalues(self):
+		return (value for sid, value in self.iteritems())
+
+	def items(self):
+		return list(self.iteritems())
+
+	def keys(self):
+		return list(self.iterkeys())
+
+	def values(self):
+		return list(self.itervalues())
+
+	def clear(self):
+		self.cache.clear()
+		for column in (self.start, self.length, self.room, self.crc):
+			column.clear()
+		self.file.truncate(0)
+		self.count = self.end = 0
+
+	def flush(self):
+		"""
+		Write the values kept in memory and the columns to their files.
+		"""
+		for sid, value in self.cache.iteritems():
+			self._write(sid, value)
+		self.file.flush()
+		for column in (self.start, self.length, self.room, self.crc):
+			column.flush()
+
+	def close(self):
+		if not self.file.closed:
+			self.flush()
+			self.file.close()
+			for column in (self.start, self.length, self.room, self.crc):
+				column.close()
+
+
+class ColumnList(object):
+	"""
+	List of state IDs (i.e. states in order of insertion) in a
+	MemmapColumn at path, only appended to.
+	"""
+	def __init__(self, path):
+		self.column = MemmapColumn(path, np.int64)
+
+	def __len__(self):
+		return len(self.column)
+
+	def __getitem__(self, i):
+		return self.column.view()[i].tolist()
+
+	def __iter__(self):
+		for first, sids in self.column.chunks():
+			for sid in sids.tolist():
+				yield sid
+
+	def append(self, sid):
+		size = len(self.column)
+		self.column.resize(size + 1)
+		self.column.data[size] = sid
+
+	def extend(self, sids):
+		for sid in sids:
+			self.append(sid)
+
+	def clear(self):
+		self.column.clear()
+
+	def flush(self):
+		self.column.flush()
+
+	def close(self):
+		self.column.close()
+
+
+class ColumnSet(object):
+	"""
+	Set of state IDs (i.e. terminal states) kept as a flag per ID in a MemmapColumn at path.
+	"""
+	def __init__(self, path):
+		self.column = MemmapColumn(path, np.int8)
+		self.count = 0
+
+	def __len__(self):
+		return self.count
+
+	def __contains__(self, sid):
+		return sid < len(self.column) and bool(self.column.data[sid])
+
+	def __iter__(self):
+		for first, flags in self.column.chunks():
+			for sid in np.flatnonzero(flags).tolist():
+				yield first + sid
+
+	def add(self, sid):
+		if sid not in self:
+			self.column.resize(max(len(self.column), sid + 1))
+			self.column.data[sid] = 1
+			self.count += 1
+
+	def update(self, sids):
+		for sid in sids:
+			self.add(sid)
+
+	def clear(self):
+		self.column.clear()
+		self.count = 0
+
+	def flush(self):
+		self.column.flush()
+
+	def close(self):
+		self.column.close()
+
+
+class DiskPriorityQueue(object):
+	"""
+	agents.PriorityQueue of state IDs in MemmapColumns at path: an
+	indexed binary heap of (priority, ID) pairs and the heap position
+	of every ID (-1 if it is not queued), so a higher priority of a
+	queued ID moves its entry instead of adding another one. The highest
+	priority is popped first, equal ones by the smaller ID, in the same
+	order as agents.PriorityQueue.
+	"""
+	def __init__(self, path):
+		self.priorities = MemmapColumn(path + '.priority.bin', np.float64)
+		self.sids = MemmapColumn(path + '.sid.bin', np.int64)
+		self.positions = MemmapColumn(path + '.position.bin', np.int64, -1)
+
+	def __len__(self):
+		return len(self.sids)
+
+	def _up(self, i, priority, sid):
+		"""
+		Put (priority, sid) at position i or above it, entries before it are moved down.
+		"""
+		priorities, sids, positions = self.priorities.data, self.sids.data, self.positions.data
+		while i > 0:
+			parent = (i - 1) // 2
+			p, s = priorities[parent], sids[parent]
+			if p > priority or p == priority and s < sid:
+				break
+			priorities[i], sids[i], positions[s] = p, s, i
+			i = parent
+		priorities[i], sids[i], positions[sid] = priority, sid, i
+
+	def _down(self, i, priority, sid):
+		"""
+		Put (priority, sid) at position i or below it, entries after it are moved up.
+		"""
+		priorities, sids, positions = self.priorities.data, self.sids.data, self.positions.data
+		size = self.sids.size
+		while 2 * i + 1 < size:
+			child = 2 * i + 1
+			p, s = priorities[child], sids[child]
+			if child + 1 < size:
+				p2, s2 = priorities[child + 1], sids[child + 1]
+				if p2 > p or p2 == p and s2 < s:
+					child, p, s = child + 1, p2, s2
+			if priority > p or priority == p and sid < s:
+				break
+			priorities[i], sids[i], positions[s] = p, s, i
+			i = child
+		priorities[i], sids[i], positions[sid] = priority, sid, i
+
+	def push(self, sid, priority):
+		positions = self.positions
+		i = positions.data.item(sid) if sid < positions.size else -1
+		if i < 0:
+			if priority > -1:
+				i = self.sids.size
+				for column in (self.priorities, self.sids):
+					column.resize(i + 1)
+				if sid >= positions.size:
+					positions.resize(sid + 1)
+				self._up(i, priority, sid)
+		elif priority > self.priorities.data.item(i):
+			self._up(i, priority, sid)
+
+	def pop(self):
+		if not len(self.sids):
+			raise IndexError("pop from an empty priority queue")
+		sid = self.sids.data.item(0)
+		last = self.sids.size - 1
+		priority, lastSid = self.priorities.data.item(last), self.sids.data.item(last)
+		self.priorities.size = self.sids.size = last
+		self.positions.data[sid] = -1
+		if last:
+			self._down(0, priority, lastSid)
+		return sid
+
+	def items(self):
+		"""
+		(ID, priority) pairs of the queued IDs.
+		"""
+		for (first, sids), (first, priorities) in izip(self.sids.chunks(), self.priorities.chunks()):
+			for pair in izip(sids.tolist(), priorities.tolist()):
+				yield pair
+
+	def update(self, items):
+		for sid, priority in items:
+			self.push(sid, priority)
+
+	def clear(self):
+		self.positions.data[self.sids.view()] = -1
+		self.priorities.clear()
+		self.sids.clear()
+
+	def flush(self):
+		for column in (self.priorities, self.sids, self.positions):
+			column.flush()
+
+	def close(self):
+		for column in (self.priorities, self.sids, self.positions):
+			column.close()
+
+
+class DiskStateIndex():
+	"""
+	On-disk hash index from states to dense integer IDs.
+
+	States are pickled into an append-only file (states.bin), offsets
+	of the pickles are a MemmapColumn. The hash table is an open
+	addressing (linear probing) table of ID + 1 in a MemmapColumn,
+	keyed by a 64 bit hash of the pickle, hashes of every ID are kept
+	so the table is rebuilt without reading states when it grows.
+	A found ID is confirmed by comparing the pickles, so equal hashes
+	of different states do not mix them up.
+	"""
+	def __init__(self, path):
+		if np is None:
+			raise ImportError("DiskStateIndex requires numpy")
+		if not os.path.isdir(path):
+			os.makedirs(path)
+		_create(os.path.join(path, 'states.bin'))
+		self.file = open(os.path.join(path, 'states.bin'), 'w+b')
+		self.offsets = MemmapColumn(os.path.join(path, 'offsets.bin'), np.int64)
+		self.offsets.resize(1)
+		self.hashes = MemmapColumn(os.path.join(path, 'hashes.bin'), np.int64)
+		self.slots = MemmapColumn(os.path.join(path, 'index.bin'), np.int64, 0, 2 * INITIAL_CAPACITY)
+		self.slots.resize(len(self.slots.data))
+
+	def __len__(self):
+		return len(self.hashes)
+
+	def _read(self, sid):
+		start, end = self.offsets.data[sid:sid + 2].tolist()
+		self.file.seek(start)
+		return self.file.read(end - start)
+
+	def _probe(self, h, key):
+		"""
+		Slot of key (a pickle with hash h) and its ID, or the empty slot where it belongs and None.
+		"""
+		slots, hashes = self.slots.data, self.hashes.data
+		mask = len(slots) - 1
+		slot = h & mask
+		while slots[slot]:
+			sid = int(slots[slot]) - 1
+			if hashes[sid] == h and self._read(sid) == key:
+				return slot, sid
+			slot = (slot + 1) & mask
+		return slot, None
+
+	def _grow(self):
+		"""
+		Double the hash table and insert all IDs again from their hashes.
+		"""
+		size = 2 * len(self.slots.data)
+		self.slots.resize(size)
+		slots = self.slots.data
+		slots[:] = 0
+		mask = size - 1
+		for sid, h in enumerate(self.hashes.view().tolist()):
+			slot = h & mask
+			while slots[slot]:
+				slot = (slot + 1) & mask
+			slots[slot] = sid + 1
+
+	def find(self, state, add=True):
+		"""
+		ID of state, a new one if it is not in the index and add is True (else None).
+		"""
+		key = _dumps(state)
+		h = _HASH.unpack(hashlib.md5(key).digest()[:8])[0]
+		slot, sid = self._probe(h, key)
+		if sid is not None or not add:
+			return sid
+
+		sid = len(self.hashes)
+		self.file.seek(0, 2)
+		self.file.write(key)
+		self.offsets.resize(sid + 2)
+		self.offsets.data[sid + 1] = self.offsets.data[sid] + len(key)
+		self.hashes.resize(sid + 1)
+		self.hashes.data[sid] = h
+		self.slots.data[slot] = sid + 1
+		if 2 * len(self.hashes) > len(self.slots.data):
+			self._grow()
+		return sid
+
+	def state(self, sid):
+		return pickle.loads(self._read(sid))
+
+	def clear(self):
+		"""
+		Forget all states.
+		"""
+		self.file.truncate(0)
+		self.offsets.clear()
+		self.offsets.resize(1)
+		self.hashes.clear()
+		self.slots.data[:] = 0
+
+	def flush(self):
+		self.file.flush()
+		for column in (self.offsets, self.hashes, self.slots):
+			column.flush()
+
+	def close(self):
+		if not self.file.closed:
+			self.flush()
+			self.file.close()
+			for column in (self.offsets, self.hashes, self.slots):
+				column.close()
+
+
+class _DiskStates():
+	"""
+	Read only sequence of the states of a DiskStateInterner (states[sid]),
+	recently used ones are kept in memory.
+	"""
+	def __init__(self, index, size):
+		self.index = index
+		self.cache = _LRU(size)
+
+	def __len__(self):
+		return len(self.index)
+
+	def __getitem__(self, sid):
+		state = self.cache.get(sid)
+		if state is None:
+			if not 0 <= sid < len(self.index):
+				raise IndexError(sid)
+			state = self.index.state(sid)
+			self.cache.store(sid, state)
+		return state
+
+	def __iter__(self):
+		# States are read in order without keeping them in memory.
+		for sid in xrange(len(self)):
+			state = self.cache.get(sid)
+			yield state if state is not None else self.index.state(sid)
+
+
+class DiskStateInterner(interning.StateInterner):
+	"""
+	Out-of-core StateInterner for state spaces larger than memory.
+
+	States are interned through a DiskStateIndex in directory path,
+	the per state values (n, reward, utility, action) are MemmapColumns
+	there instead of in-memory columns, and table gives ColumnTables of
+	them. The nested tables (stateDict, modelTable) are ObjectTables, the
+	insertion order, terminal states and the prioritized sweeping queue
+	are a ColumnList, a ColumnSet and a DiskPriorityQueue there as well.
+	Only hotStates recently used states and IDs (their possible actions
+	and values of every ObjectTable) are kept in memory, so memory does
+	not grow with the number of states. Files in path are overwritten.
+
+	Use close (or a with statement) to write everything to the files
+	and release them.
+	"""
+	def __init__(self, env, path, hotStates=HOT_STATES):
+		interning.StateInterner.__init__(self, env)
+		self.path = path
+		self.hotStates = hotStates
+		self.index = DiskStateIndex(path)
+		self.states = _DiskStates(self.index, hotStates)
+		self.stateIds = _LRU(hotStates)
+		self.stateActions = _LRU(hotStates)
+		self.columns = {
+			'n': (MemmapColumn(os.path.join(path, 'n.bin'), np.int64, -1), -1),
+			'reward': (MemmapColumn(os.path.join(path, 'reward.bin'), np.float64, np.nan), np.nan),
+			'utility': (MemmapColumn(os.path.join(path, 'utility.bin'), np.float64, np.nan), np.nan),
+			'action': (MemmapColumn(os.path.join(path, 'action.bin'), np.int32, -1), -1),
+		}
+		# Tables made by the methods below, flushed and closed together with the interner.
+		self.stores = {}
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def _store(self, name, store):
+		if name in self.stores:
+			self.stores[name].close()
+		self.stores[name] = store
+		return store
+
+	def stateId(self, state):
+		sid = self.stateIds.get(state)
+		if sid is None:
+			sid = self.index.find(state)
+			if sid >= len(self.columns['n'][0]):
+				for column, missing in self.columns.itervalues():
+					column.resize(sid + 1)
+			self.stateIds.store(state, sid)
+			self.states.cache.store(sid, state)
+		return sid
+
+	def find(self, state):
+		sid = self.stateIds.get(state)
+		return sid if sid is not None else self.index.find(state, add=False)
+
+	def table(self, field):
+		column, missing = self.columns[field]
+		return ColumnTable(column, missing)
+
+	def stateDict(self):
+		return self.modelTable('trans')
+
+	def modelTable(self, name):
+		return self._store(name, ObjectTable(os.path.join(self.path, name), self.hotStates))
+
+	def stateList(self):
+		return self._store('order', ColumnList(os.path.join(self.path, 'order.bin')))
+
+	def stateSet(self):
+		return self._store('terminals', ColumnSet(os.path.join(self.path, 'terminals.bin')))
+
+	def priorityQueue(self):
+		return self._store('queue', DiskPriorityQueue(os.path.join(self.path, 'queue')))
+
+	def restore(self, states, actions):
+		"""
+		Replace the known states and actions by the given ones (their IDs
+		and codes are their order), every value is missing. states may be
+		an iterator, they are added to the index one by one, and the tables
+		made by this interner are cleared.
+		"""
+		self.index.clear()
+		self.states.cache.clear()
+		self.stateIds.clear()
+		self.stateActions.clear()
+		for state in states:
+			self.index.find(state)
+		for column, missing in self.columns.itervalues():
+			column.clear()
+			column.resize(len(self.index))
+		for store in self.stores.itervalues():
+			store.clear()
+		self.actions = list(actions)
+		self.actionCodes = dict(izip(self.actions, xrange(len(self.actions))))
+
+	def getActions(self, state):
+		actions = self.stateActions.get(state)
+		if actions is None:
+			actions = tuple(self.actionCode(ac) for ac in self.env.getActions(self.states[state]))
+			self.stateActions.store(state, actions)
+		return list(actions)
+
+	def flush(self):
+		"""
+		Write the index, the columns and the tables to their files.
+		"""
+		self.index.flush()
+		for column, missing in self.columns.itervalues():
+			column.flush()
+		for store in self.stores.itervalues():
+			store.flush()
+
+	def close(self):
+		"""
+		Flush and close all files, the interner and its tables can not be used afterwards.
+		"""
+		for store in self.stores.itervalues():
+			store.close()
+		self.index.close()
+		for column, missing in self.columns.itervalues():
+			column.close()
@@ -2,6 +2,7 @@
 import environments as e
 import agents as a
 import operator
+import runner
 
 ALGORITHMS = (
 	a.adp_optimistic_rewards,
@@ -12,6 +13,7 @@ MAX_ITERATIONS = (
 )
 NUM_OF_TRIALS = 500
 NUM_OF_TESTS = 50
+PROCESSES = None # number of worker processes, None for all CPUs
 ENVIRONMENTS = (
 	e.simple4,
 	e.simple5,
@@ -24,22 +26,22 @@ success = {}
 
 def test():
 
+	# Every test is independent, so they are all run in parallel.
+	jobs = []
 	for alg in ALGORITHMS:
 		for env in ENVIRONMENTS:
 			for maxIter in MAX_ITERATIONS:
-				rewards = []
 				for tst in range(NUM_OF_TESTS):
-					agent = a.Agent()
-					agent.learn(env, alg=alg, numOfTrials=NUM_OF_TRIALS, maxItr=maxIter)
 					test_id = (alg.func_name, env.name, maxIter, NUM_OF_TRIALS, tst, )
-				
-					result = agent.solve(env, agent.getPolicy())
-					rewards.append(1 if result[1] > 0 else 0)
-
-					
-				success[test_id] = float(sum(rewards)) / NUM_OF_TESTS
-				results[test_id] = result
-					
+					jobs.append((test_id, env, alg, NUM_OF_TRIALS, {'maxItr': maxIter}))
+
+	rewards = {}
+	for test_id, result, history in runner.run(jobs, processes=PROCESSES):
+		rewards.setdefault(test_id[:-1], []).append(1 if result[1] > 0 else 0)
+		results[test_id] = result
+
+	for key, wins in rewards.iteritems():
+		success[key] = float(sum(wins)) / NUM_OF_TESTS
 	
 	from pprint import pprint
 	pprint(success)
@@ -1,5 +1,6 @@
 import environments as env
 import agents as ag
+import solvers
 
 # we are testing it on the very simple environment Celje
 a = ag.Agent()
@@ -15,6 +16,7 @@ env.CELJE.printPolicy(a.getPolicy())
 # get solution and print it for this simple example
 solution = a.solve(env.CELJE, a.getPolicy())
 print "Solution steps: " + str(solution)
+print "Optimal solution steps: " + str(solvers.astar(env.CELJE))
 
 # print solution steps in graphics
 state = env.CELJE.getStartingState()
@@ -43,4 +45,4 @@ state = env.CELJE.getStartingState()
 for move in solution[0]:
 	env.CELJE.printState(state)
 	state, reward, is_terminal = env.CELJE.do(state, move)
-env.CELJE.printState(state)
\ No newline at end of file
+env.CELJE.printState(state)